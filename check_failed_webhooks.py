@@ -3,8 +3,11 @@
 
 from __future__ import annotations
 
+import io
+import json
 import os
 import pickle
+from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any
 
@@ -12,6 +15,7 @@ from cryptography.fernet import Fernet
 
 
 FAILED_WEBHOOKS_PATH = Path("encrypted_states/failed_webhooks.enc")
+STATE_READ_FAILURE_ALERT_PATH = Path("encrypted_states/state_read_failure_alert.json")
 OUTPUT_PATH = Path("failed_webhooks_readable.txt")
 
 
@@ -25,6 +29,36 @@ def format_webhook(webhook: dict[str, Any]) -> str:
     return "\n".join(lines)
 
 
+class RestrictedUnpickler(pickle.Unpickler):
+    """Legacy queues only hold plain containers; never resolve globals from them."""
+
+    def find_class(self, module: str, name: str) -> Any:
+        raise pickle.UnpicklingError(f"Refusing to load global {module}.{name}")
+
+
+def decode_entry(decrypted: bytes) -> Any:
+    try:
+        return json.loads(decrypted)
+    except ValueError:
+        # Queue written before the state files moved to JSON
+        return RestrictedUnpickler(io.BytesIO(decrypted)).load()
+
+
+def save_state_read_failure_alert(error_message: str) -> None:
+    """Flag an unreadable queue for the workflow's state read failure email."""
+    alert_data = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "event": "state_decryption_failed",
+        "failed_files": [str(FAILED_WEBHOOKS_PATH)],
+        "error_message": error_message,
+        "run_id": os.environ.get("GITHUB_RUN_NUMBER", "unknown"),
+        "action_required": "Check STATE_ENCRYPTION_KEY secret and encrypted state files",
+    }
+    STATE_READ_FAILURE_ALERT_PATH.write_text(
+        json.dumps(alert_data, ensure_ascii=False, indent=2), encoding="utf-8"
+    )
+
+
 def main() -> None:
     try:
         key = os.environ["STATE_ENCRYPTION_KEY"].encode()
@@ -33,14 +67,26 @@ def main() -> None:
         return
 
     try:
-        encrypted_data = FAILED_WEBHOOKS_PATH.read_bytes()
-        decrypted = Fernet(key).decrypt(encrypted_data)
-        failed_webhooks = pickle.loads(decrypted)
+        fernet = Fernet(key)
+        failed_webhooks: list[Any] = []
+        # One Fernet token per line; older queues hold a single token with a whole list
+        for line in FAILED_WEBHOOKS_PATH.read_bytes().splitlines():
+            if not line.strip():
+                continue
+            entry = decode_entry(fernet.decrypt(line.strip()))
+            if isinstance(entry, list):
+                failed_webhooks.extend(entry)
+            else:
+                failed_webhooks.append(entry)
     except Exception as exc:  # pragma: no cover - best effort logging only
+        try:
+            save_state_read_failure_alert(str(exc))
+        except OSError:
+            pass
         print(f"ERROR:{exc}")
         return
 
-    if isinstance(failed_webhooks, list) and failed_webhooks:
+    if failed_webhooks:
         OUTPUT_PATH.write_text(
             "\n".join(format_webhook(item) for item in failed_webhooks),
             encoding="utf-8",
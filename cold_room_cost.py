@@ -4,13 +4,17 @@ from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 import os
 import json
-import time
-import random
 from typing import Any
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-from datetime import datetime, timedelta, timezone
+from http.client import HTTPException
+import socket
+import httplib2
+from google.auth.exceptions import TransportError
+from tenacity import retry, stop_after_attempt, wait_exponential, wait_random, retry_if_exception
+from datetime import datetime
+from zoneinfo import ZoneInfo
 
 GOOGLE_SHEETS_SCOPE = ['https://www.googleapis.com/auth/spreadsheets']
+WAT_TZ = ZoneInfo('Africa/Lagos')  # WAT is UTC+1, no DST
 
 # Baseline stock count values (2-Jan-2026)
 # Read from environment variables (GitHub secrets) or fall back to local config
@@ -49,9 +53,7 @@ class DataProcessingError(Exception):
 
 def get_wat_timestamp() -> str:
     """Get current timestamp in WAT timezone with AM/PM format"""
-    # WAT is UTC+1
-    utc_now = datetime.now(timezone.utc)
-    wat_now = utc_now + timedelta(hours=1)
+    wat_now = datetime.now(WAT_TZ)
 
     # Format: "January 10, 2025 at 3:45 PM WAT"
     formatted_time = wat_now.strftime("%B %d, %Y at %-I:%M %p WAT")
@@ -60,26 +62,30 @@ def get_wat_timestamp() -> str:
 def is_rate_limit_error(exception):
     """Check if the exception is a rate limit error"""
     if isinstance(exception, HttpError):
-        return exception.resp.status in [429, 500, 502, 503]
+        return exception.resp.status in [429, 500, 502, 503, 504]
     if isinstance(exception, Exception):
         error_str = str(exception).lower()
         return any(term in error_str for term in ['quota', 'rate limit', 'too many requests', '429'])
     return False
 
+TRANSIENT_NETWORK_ERRORS = (ConnectionError, TimeoutError, socket.timeout, HTTPException,
+                            httplib2.HttpLib2Error, TransportError)
+
+def is_transient_api_error(exception):
+    """Retry Sheets rate limits and 5xx responses, plus network failures."""
+    if isinstance(exception, TRANSIENT_NETWORK_ERRORS):
+        return True
+    return is_rate_limit_error(exception)
+
 @retry(
-    retry=retry_if_exception_type((HttpError, Exception)),
+    retry=retry_if_exception(is_transient_api_error),
     stop=stop_after_attempt(5),
-    wait=wait_exponential(multiplier=1, min=1, max=30),
-    before_sleep=lambda retry_state: print(f"Rate limit hit, retrying in {retry_state.next_action.sleep} seconds... (attempt {retry_state.attempt_number})")
+    wait=wait_exponential(multiplier=1, min=1, max=10) + wait_random(0.5, 2.0),
+    before_sleep=lambda retry_state: print(f"Transient API error, retrying in {retry_state.next_action.sleep:.1f} seconds... (attempt {retry_state.attempt_number})")
 )
 def robust_sheets_operation(operation_func, *args, **kwargs):
     """Execute sheets operation with robust retry logic"""
-    try:
-        return operation_func(*args, **kwargs)
-    except Exception as e:
-        if is_rate_limit_error(e):
-            time.sleep(random.uniform(0.5, 2.0))
-        raise
+    return operation_func(*args, **kwargs)
 
 def get_credentials(credentials_file: str) -> service_account.Credentials:
     """Create and return credentials for Google Sheets access"""
@@ -99,7 +105,8 @@ def read_summary_sheet(service: Any, spreadsheet_id: str) -> pd.DataFrame:
         def _get_summary_data():
             return service.spreadsheets().values().get(
                 spreadsheetId=spreadsheet_id,
-                range='summary!A:ZZ'
+                range='summary!A:ZZ',
+                fields='values'  # only the cell values are read
             ).execute()
 
         result = robust_sheets_operation(_get_summary_data)
@@ -158,25 +165,13 @@ def create_whole_chicken_report(df: pd.DataFrame) -> pd.DataFrame:
 
         # Calculate BIRD STORED = current inflow + previous month balance (with absolute value)
         # For first month, add baseline since there's no previous ETL balance
-        report_df['BIRD STORED'] = 0.0
-        for i in range(len(report_df)):
-            if i == 0:
-                # First month: include baseline stock from 2-Jan-2026 stock count
-                report_df.iloc[i, report_df.columns.get_loc('BIRD STORED')] = abs(report_df.iloc[i]['TOTAL INFLOW'] + BASELINE_WC_QTY)
-            else:
-                report_df.iloc[i, report_df.columns.get_loc('BIRD STORED')] = \
-                    abs(report_df.iloc[i]['TOTAL INFLOW'] + report_df.iloc[i-1]['BALANCE'])
+        previous_balance = report_df['BALANCE'].shift(1, fill_value=BASELINE_WC_QTY)
+        report_df['BIRD STORED'] = (report_df['TOTAL INFLOW'] + previous_balance).abs().astype(float)
 
         # Calculate WEIGHT STORED = current inflow weight + previous month weight balance (with absolute value)
         # For first month, add baseline since there's no previous ETL balance
-        report_df['WEIGHT STORED'] = 0.0
-        for i in range(len(report_df)):
-            if i == 0:
-                # First month: include baseline stock from 2-Jan-2026 stock count
-                report_df.iloc[i, report_df.columns.get_loc('WEIGHT STORED')] = abs(report_df.iloc[i]['INFLOW WEIGHT'] + BASELINE_WC_WEIGHT)
-            else:
-                report_df.iloc[i, report_df.columns.get_loc('WEIGHT STORED')] = \
-                    abs(report_df.iloc[i]['INFLOW WEIGHT'] + report_df.iloc[i-1]['WEIGHT BALANCE'])
+        previous_weight_balance = report_df['WEIGHT BALANCE'].shift(1, fill_value=BASELINE_WC_WEIGHT)
+        report_df['WEIGHT STORED'] = (report_df['INFLOW WEIGHT'] + previous_weight_balance).abs().astype(float)
 
         # Round quantity columns to 0 decimal places
         quantity_cols = ['TOTAL INFLOW', 'TOTAL RELEASE', 'BALANCE', 'BIRD STORED']
@@ -222,15 +217,9 @@ def create_combined_report(df: pd.DataFrame) -> pd.DataFrame:
 
         # Calculate WEIGHT STORED = current inflow weight + previous month weight balance (with absolute value)
         # For first month, add baseline since there's no previous ETL balance
-        report_df['WEIGHT STORED'] = 0.0
         combined_baseline_weight = BASELINE_WC_WEIGHT + BASELINE_GIZZARD_WEIGHT
-        for i in range(len(report_df)):
-            if i == 0:
-                # First month: include baseline stock from 2-Jan-2026 stock count
-                report_df.iloc[i, report_df.columns.get_loc('WEIGHT STORED')] = abs(report_df.iloc[i]['INFLOW WEIGHT'] + combined_baseline_weight)
-            else:
-                report_df.iloc[i, report_df.columns.get_loc('WEIGHT STORED')] = \
-                    abs(report_df.iloc[i]['INFLOW WEIGHT'] + report_df.iloc[i-1]['WEIGHT BALANCE'])
+        previous_weight_balance = report_df['WEIGHT BALANCE'].shift(1, fill_value=combined_baseline_weight)
+        report_df['WEIGHT STORED'] = (report_df['INFLOW WEIGHT'] + previous_weight_balance).abs().astype(float)
 
         # Round numeric columns to 2 decimal places
         numeric_cols = ['INFLOW WEIGHT', 'RELEASE WEIGHT', 'WEIGHT BALANCE', 'WEIGHT STORED']
@@ -1183,7 +1172,8 @@ def main():
 
         # Create credentials and service
         credentials = get_credentials(CREDENTIALS_FILE)
-        sheets_service = build('sheets', 'v4', credentials=credentials)
+        sheets_service = build('sheets', 'v4', credentials=credentials,
+                               static_discovery=True, cache_discovery=False)
 
         # Read summary sheet
         summary_df = read_summary_sheet(sheets_service, etl_spreadsheet_id)
@@ -2,16 +2,18 @@
 """Daily Inventory Log - Records end-of-day Whole Chicken inventory levels to Google Sheets."""
 
 import os
-import time
-import random
 from datetime import datetime
+from zoneinfo import ZoneInfo
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from http.client import HTTPException
+import socket
+import httplib2
+from google.auth.exceptions import TransportError
 import requests
 import gspread
-import pytz
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from tenacity import retry, stop_after_attempt, wait_exponential, wait_random, retry_if_exception, retry_if_exception_type
 
 # Constants
 DAILY_LOG_SPREADSHEET_ID = os.environ.get('DAILY_LOG_SPREADSHEET_ID')
@@ -24,6 +26,8 @@ SERVICE_ACCOUNT_FILE = 'service-account.json'
 STOCK_SHEET_NAME = 'Balance'
 STOCK_RANGE = 'A1:EX5'
 LOG_SHEET_NAME = 'Daily Inventory Log'
+# Balance sheet product headers that are bookkeeping columns, not stock
+SKIP_PRODUCTS = frozenset({'DATE', 'NOTES'})
 
 # Stock threshold alert configuration
 STOCK_THRESHOLDS_WEBHOOK_URL = os.environ.get('STOCK_THRESHOLDS_WEBHOOK_URL')
@@ -31,7 +35,7 @@ LOW_STOCK_THRESHOLD = 10   # tonnes
 HIGH_STOCK_THRESHOLD = 30  # tonnes
 
 # Lagos timezone (WAT = UTC+1)
-WAT_TZ = pytz.timezone('Africa/Lagos')
+WAT_TZ = ZoneInfo('Africa/Lagos')
 
 # Header formatting colors (hex: #2E5494 for background, #FFFFFF for text)
 HEADER_BG_COLOR = {'red': 0.18, 'green': 0.33, 'blue': 0.58}
@@ -46,25 +50,37 @@ class DailyLogError(Exception):
 def is_rate_limit_error(exception):
     """Check if the exception is a rate limit error."""
     if isinstance(exception, HttpError):
-        return exception.resp.status in [429, 500, 502, 503]
+        return exception.resp.status in [429, 500, 502, 503, 504]
     error_str = str(exception).lower()
     return any(term in error_str for term in ['quota', 'rate limit', 'too many requests', '429'])
 
 
+TRANSIENT_NETWORK_ERRORS = (ConnectionError, TimeoutError, socket.timeout, HTTPException,
+                            httplib2.HttpLib2Error, TransportError)
+
+def is_transient_api_error(exception):
+    """Retry gspread/Sheets rate limits and 5xx responses, plus network failures."""
+    if isinstance(exception, gspread.exceptions.APIError):
+        return exception.response.status_code in [429, 500, 502, 503, 504]
+    if isinstance(exception, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(exception, requests.exceptions.RequestException):
+        # Other requests errors (e.g. HTTPError) are OSError subclasses but not transient
+        return False
+    if isinstance(exception, TRANSIENT_NETWORK_ERRORS):
+        return True
+    return is_rate_limit_error(exception)
+
+
 @retry(
-    retry=retry_if_exception_type((HttpError, Exception)),
+    retry=retry_if_exception(is_transient_api_error),
     stop=stop_after_attempt(5),
-    wait=wait_exponential(multiplier=1, min=1, max=30),
-    before_sleep=lambda retry_state: print(f"Rate limit hit, retrying in {retry_state.next_action.sleep} seconds...")
+    wait=wait_exponential(multiplier=1, min=1, max=10) + wait_random(0.5, 2.0),
+    before_sleep=lambda retry_state: print(f"Transient API error, retrying in {retry_state.next_action.sleep:.1f} seconds...")
 )
 def robust_api_call(api_func, *args, **kwargs):
     """Execute API call with robust retry logic."""
-    try:
-        return api_func(*args, **kwargs)
-    except Exception as e:
-        if is_rate_limit_error(e):
-            time.sleep(random.uniform(0.5, 2.0))
-        raise
+    return api_func(*args, **kwargs)
 
 
 def get_credentials():
@@ -79,7 +95,8 @@ def get_credentials():
 def get_services():
     """Create and return Google Sheets service objects."""
     credentials = get_credentials()
-    sheets_service = build('sheets', 'v4', credentials=credentials)
+    sheets_service = build('sheets', 'v4', credentials=credentials,
+                           static_discovery=True, cache_discovery=False)
     gspread_client = gspread.Client(auth=credentials)
     return sheets_service, gspread_client
 
@@ -122,7 +139,7 @@ def parse_balance_data(data):
         if i < len(row_product) and row_product[i] and row_product[i].strip():
             current_product = row_product[i].strip()
 
-        if current_product in ['DATE', 'NOTES']:
+        if current_product in SKIP_PRODUCTS:
             continue
 
         grade_cell = row_grade[i].strip() if i < len(row_grade) and row_grade[i] else ""
@@ -192,7 +209,8 @@ def get_balance_sheet_data(sheets_service):
     def _fetch_data():
         result = sheets_service.spreadsheets().values().get(
             spreadsheetId=SPECIFICATION_SHEET_ID,
-            range=f'{STOCK_SHEET_NAME}!{STOCK_RANGE}'
+            range=f'{STOCK_SHEET_NAME}!{STOCK_RANGE}',
+            fields='values'  # only the cell values are read
         ).execute()
         return result.get('values', [])
 
@@ -391,6 +409,12 @@ def build_high_stock_alert_card(inventory_tonnes, date_str, timestamp):
     return card
 
 
+# One session so both threshold alerts and their retries reuse a keep-alive connection.
+# Transport-level retries stay off; tenacity owns retries.
+WEBHOOK_SESSION = requests.Session()
+WEBHOOK_SESSION.mount('https://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0))
+
+
 @retry(
     retry=retry_if_exception_type((requests.exceptions.ConnectionError,
                                    requests.exceptions.Timeout)),
@@ -403,7 +427,7 @@ def build_high_stock_alert_card(inventory_tonnes, date_str, timestamp):
 )
 def send_threshold_alert(webhook_url, card_payload):
     """Send a threshold alert card to Google Chat via webhook."""
-    response = requests.post(webhook_url, json=card_payload, timeout=10)
+    response = WEBHOOK_SESSION.post(webhook_url, json=card_payload, timeout=10)
     if not response.ok:
         print(f"Threshold alert webhook error: {response.status_code} - {response.text[:500]}")
     response.raise_for_status()
@@ -690,7 +714,7 @@ def main():
         sheets_service, gspread_client = get_services()
         ensure_sheet_formatting(gspread_client, sheets_service)
 
-        current_time = datetime.now(pytz.UTC).astimezone(WAT_TZ)
+        current_time = datetime.now(WAT_TZ)
         date_components = format_date_components(current_time)
 
         balance_data = get_balance_sheet_data(sheets_service)
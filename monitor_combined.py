@@ -1,17 +1,24 @@
+import io
 import os
 import json
 import pickle
-import random
 import re
-import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import groupby, zip_longest
+from http.client import HTTPException
+import socket
+import httplib2
+from google.auth.exceptions import TransportError
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-import requests
+from googleapiclient.http import build_http
+from google_auth_httplib2 import AuthorizedHttp
 from datetime import datetime
-import pytz
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type, retry_if_exception
-import pybreaker
+from zoneinfo import ZoneInfo
+from tenacity import retry, stop_after_attempt, wait_exponential, wait_random, retry_if_exception
 from cryptography.fernet import Fernet
 import subprocess
 
@@ -25,6 +32,8 @@ if not SPECIFICATION_SHEET_ID:
     
 STOCK_SHEET_NAME = 'Balance'
 STOCK_RANGE = 'A1:GZ5'  # Range covers A-GZ columns (208 cols) with 5 rows for multi-row headers; wider than the current ~186 cols so newly added products aren't silently truncated
+# Balance sheet product headers that are bookkeeping columns, not stock
+SKIP_PRODUCTS = frozenset({'DATE', 'NOTES'})
 
 INVENTORY_SHEET_NAME = 'summary'  # The sheet name from the inventory tracking spreadsheet
 INVENTORY_RANGE = 'A:ZZ'  # Wide range: transformation.py builds summary columns dynamically, so positions shift run-to-run. 'A:BZ' (78 cols) sometimes truncated the gizzard balance columns (~CA/CB), silently dropping the ETL value and firing phantom gizzard discrepancy alerts. Extra headroom keeps newly added columns from being lost.
@@ -33,6 +42,8 @@ INVENTORY_RANGE = 'A:ZZ'  # Wide range: transformation.py builds summary columns
 # No separate parts sheet needed
 
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets.readonly']
+
+WAT_TZ = ZoneInfo('Africa/Lagos')
 SERVICE_ACCOUNT_FILE = 'service-account.json'
 
 # Baseline stock count values (2-Jan-2026)
@@ -137,12 +148,42 @@ PARTS_WEIGHT_DIFF_STATE_FILE = os.path.join(ENCRYPTED_STATES_DIR, 'parts_weight_
 FAILED_WEBHOOKS_FILE = os.path.join(ENCRYPTED_STATES_DIR, 'failed_webhooks.enc')
 STATE_READ_FAILURE_ALERT_FILE = os.path.join(ENCRYPTED_STATES_DIR, 'state_read_failure_alert.json')
 
-# Circuit breaker for webhook calls
-webhook_circuit_breaker = pybreaker.CircuitBreaker(
-    fail_max=5,           # Open circuit after 5 consecutive failures
-    reset_timeout=60,     # Try again after 60 seconds
-    exclude=[requests.exceptions.HTTPError]  # Don't count 4xx errors as failures
-)
+def is_webhook_http_error(exception):
+    """Circuit breaker exclusion: HTTP error responses are not an outage."""
+    import requests
+    return isinstance(exception, requests.exceptions.HTTPError)
+
+# requests and pybreaker are only needed on runs that actually send an alert, so
+# they are imported lazily; most runs find no changes and never pay their import cost.
+_webhook_circuit_breaker = None
+_webhook_session = None
+
+def get_webhook_circuit_breaker():
+    """Circuit breaker for webhook calls, created on first use."""
+    global _webhook_circuit_breaker
+    if _webhook_circuit_breaker is None:
+        import pybreaker
+        _webhook_circuit_breaker = pybreaker.CircuitBreaker(
+            fail_max=5,           # Open circuit after 5 consecutive failures
+            reset_timeout=60,     # Try again after 60 seconds
+            exclude=[is_webhook_http_error]  # Don't count 4xx errors as failures
+        )
+    return _webhook_circuit_breaker
+
+def get_webhook_session():
+    """Shared HTTP session for webhook posts so retries reuse the pooled keep-alive
+    connection instead of paying a new TCP/TLS handshake on every attempt.
+
+    Transport-level retries stay off (max_retries=0): tenacity + the circuit breaker
+    in send_combined_alert already own the retry policy, and stacking urllib3
+    retries underneath would multiply the attempts.
+    """
+    global _webhook_session
+    if _webhook_session is None:
+        import requests
+        _webhook_session = requests.Session()
+        _webhook_session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0))
+    return _webhook_session
 
 # Encryption/Decryption Functions
 def get_encryption_key():
@@ -152,35 +193,82 @@ def get_encryption_key():
         raise ValueError("STATE_ENCRYPTION_KEY environment variable not set")
     return key.encode()
 
+_fernet = None
+
+def get_fernet():
+    """Return the Fernet instance for the state key, built once per run.
+
+    Constructing Fernet base64-decodes and splits the key, and every state file is
+    decrypted and re-checked on save, so reuse a single instance.
+    """
+    global _fernet
+    if _fernet is None:
+        _fernet = Fernet(get_encryption_key())
+    return _fernet
+
 def encrypt_state_data(data):
-    """Encrypt state data using Fernet."""
+    """Encrypt state data using Fernet.
+
+    State is serialized as compact JSON (lists, dicts, strings and numbers only),
+    which is smaller and cheaper to produce than a pickle of the same data.
+    """
     try:
-        key = get_encryption_key()
-        fernet = Fernet(key)
-        serialized_data = pickle.dumps(data)
-        encrypted_data = fernet.encrypt(serialized_data)
+        serialized_data = json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        encrypted_data = get_fernet().encrypt(serialized_data)
         return encrypted_data
     except Exception as e:
         print(f"Error encrypting state data: {str(e)}")
         raise
 
+class RestrictedUnpickler(pickle.Unpickler):
+    """Unpickler for legacy state payloads that refuses to resolve any global.
+
+    Legacy state only ever held lists, dicts, strings and numbers, which pickle encodes
+    without globals, so a payload that names a class or function is rejected instead
+    of importing and calling it.
+    """
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f"Refusing to load global {module}.{name} from legacy state")
+
+def decode_state_payload(decrypted_data):
+    """Deserialize a decrypted state payload.
+
+    Returns: Tuple of (data, is_legacy). Files written before the switch to JSON hold
+    a pickle payload; those are still readable and flagged so save_current_state
+    rewrites them as JSON even when the state itself hasn't changed.
+    """
+    try:
+        return json.loads(decrypted_data), False
+    except ValueError:
+        return RestrictedUnpickler(io.BytesIO(decrypted_data)).load(), True
+
 def decrypt_state_data(encrypted_data):
     """Decrypt state data using Fernet."""
     try:
-        key = get_encryption_key()
-        fernet = Fernet(key)
-        decrypted_data = fernet.decrypt(encrypted_data)
-        data = pickle.loads(decrypted_data)
+        decrypted_data = get_fernet().decrypt(encrypted_data)
+        data, _is_legacy = decode_state_payload(decrypted_data)
         return data
     except Exception as e:
         print(f"Error decrypting state data: {str(e)}")
         raise
 
+def write_state_file(path, encrypted_data):
+    """Write encrypted bytes via a temp file and os.replace so a crash mid-write
+    never leaves a truncated state file behind. The temp file is fsynced before the
+    rename so the replaced file can't turn up empty after a power loss either."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(encrypted_data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
 def save_state_read_failure_alert(failed_files, error_message):
     """Save state read failure alert for email notification."""
     try:
         alert_data = {
-            'timestamp': datetime.now(pytz.UTC).astimezone(pytz.timezone('Africa/Lagos')).isoformat(),
+            'timestamp': datetime.now(WAT_TZ).isoformat(),
             'event': 'state_decryption_failed',
             'failed_files': failed_files,
             'error_message': str(error_message),
@@ -200,19 +288,19 @@ def save_state_read_failure_alert(failed_files, error_message):
 def commit_encrypted_state_files():
     """Commit encrypted state files to the encrypted-state branch via worktree."""
     try:
-        subprocess.run(['git', 'config', 'user.name', 'github-actions[bot]'],
-                      cwd=ENCRYPTED_STATES_DIR, check=True)
-        subprocess.run(['git', 'config', 'user.email', 'github-actions[bot]@users.noreply.github.com'],
-                      cwd=ENCRYPTED_STATES_DIR, check=True)
-
-        subprocess.run(['git', 'add', '-A'], cwd=ENCRYPTED_STATES_DIR, check=True)
-
-        result = subprocess.run(['git', 'diff', '--cached', '--exit-code'],
-                               cwd=ENCRYPTED_STATES_DIR, capture_output=True)
+        # One porcelain status call covers the common no-change run; the add/commit/push
+        # sequence only runs when a state file was actually rewritten
+        status = subprocess.run(['git', 'status', '--porcelain'],
+                                cwd=ENCRYPTED_STATES_DIR, capture_output=True, text=True, check=True)
 
-        if result.returncode != 0:
+        if status.stdout.strip():
+            subprocess.run(['git', 'add', '-A'], cwd=ENCRYPTED_STATES_DIR, check=True)
             commit_message = f"Update encrypted state files - Run {os.environ.get('GITHUB_RUN_NUMBER', 'unknown')}"
-            subprocess.run(['git', 'commit', '-m', commit_message], cwd=ENCRYPTED_STATES_DIR, check=True)
+            # Identity passed per-command instead of two separate `git config` runs
+            subprocess.run(['git',
+                            '-c', 'user.name=github-actions[bot]',
+                            '-c', 'user.email=github-actions[bot]@users.noreply.github.com',
+                            'commit', '-m', commit_message], cwd=ENCRYPTED_STATES_DIR, check=True)
             subprocess.run(['git', 'push', 'origin', 'HEAD:encrypted-state'], cwd=ENCRYPTED_STATES_DIR, check=True)
             print("Encrypted state files committed and pushed successfully")
         else:
@@ -257,7 +345,8 @@ def parse_balance_data(data):
         'product': str,
         'grade': str,
         'metric': str,
-        'value': str
+        'value': str,
+        'number': float or None  # value parsed once via parse_number(); None if not numeric
     }, ...]
     """
     if not data or len(data) < 5:
@@ -273,26 +362,27 @@ def parse_balance_data(data):
     current_product = ""
     current_grade = ""
 
-    # Iterate over the longest row (usually row_data or row_metric)
-    max_cols = max(len(row_product), len(row_grade), len(row_data), len(row_metric))
-
-    for i in range(max_cols):
+    # Walk the four rows in lockstep; zip_longest pads the shorter rows with "" so the
+    # loop needs no per-cell bounds checks
+    columns = zip_longest(row_product, row_grade, row_data, row_metric, fillvalue="")
+    for i, (product_cell, grade_cell, value_cell, metric_cell) in enumerate(columns):
         # Track current product
-        if i < len(row_product) and row_product[i] and row_product[i].strip():
-            current_product = row_product[i].strip()
+        product_cell = product_cell.strip()
+        if product_cell:
+            current_product = product_cell
 
         # Skip DATE and NOTES columns
-        if current_product in ['DATE', 'NOTES']:
+        if current_product in SKIP_PRODUCTS:
             continue
 
         # Track current grade (grade cells span multiple columns, so we need to remember)
-        grade_cell = row_grade[i].strip() if i < len(row_grade) and row_grade[i] else ""
+        grade_cell = grade_cell.strip()
         if grade_cell:
             current_grade = grade_cell
 
         # Get metric
-        metric = row_metric[i].strip() if i < len(row_metric) and row_metric[i] else ""
-        value = row_data[i].strip() if i < len(row_data) and row_data[i] else "0"
+        metric = metric_cell.strip()
+        value = value_cell.strip() if value_cell else "0"
 
         # Include columns that have product, grade (current), and metric
         if current_product and current_grade and metric:
@@ -301,15 +391,45 @@ def parse_balance_data(data):
                 'product': current_product,
                 'grade': current_grade,
                 'metric': metric,
-                'value': value
+                'value': value,
+                'number': parse_number(value)
             })
 
     return parsed_columns
 
+def pivot_balance_columns(parsed_columns):
+    """Group parsed Balance columns in one pass as {product: {grade: {metric: number}}}.
+
+    Products and grades keep their sheet order; number is the column's parsed value
+    (None when the cell is not numeric).
+    """
+    pivot = {}
+    for col in parsed_columns:
+        pivot.setdefault(col['product'], {}).setdefault(col['grade'], {})[col['metric']] = col['number']
+    return pivot
+
+# Sheet numbers may carry thousands separators ("1,234.5"); anything else is text
+NUMBER_PATTERN = re.compile(r'-?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?|-?\.\d+')
+
+def parse_number(value):
+    """Parse a sheet cell into a float with a single regex match.
+
+    Returns None when the cell is not a plain number so callers can branch on the
+    result instead of wrapping every conversion in try/except.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    if not NUMBER_PATTERN.fullmatch(text):
+        return None
+    return float(text.replace(',', ''))
+
 def is_rate_limit_error(exception):
     """Check if the exception is a rate limit error"""
     if isinstance(exception, HttpError):
-        return exception.resp.status in [429, 500, 502, 503]
+        return exception.resp.status in [429, 500, 502, 503, 504]
     if isinstance(exception, Exception):
         error_str = str(exception).lower()
         return any(term in error_str for term in ['quota', 'rate limit', 'too many requests', '429'])
@@ -317,6 +437,7 @@ def is_rate_limit_error(exception):
 
 def should_retry_webhook(exception):
     """Determine if webhook should be retried based on error type"""
+    import requests
     if isinstance(exception, requests.exceptions.HTTPError):
         # Don't retry 4xx client errors (permanent failures)
         if 400 <= exception.response.status_code < 500:
@@ -337,32 +458,23 @@ def save_failed_webhook(payload, error_msg, webhook_url):
             'payload': payload,
             'webhook_url': webhook_url,
             'error': str(error_msg),
-            'timestamp': datetime.now(pytz.UTC).astimezone(pytz.timezone('Africa/Lagos')).isoformat(),
+            'timestamp': datetime.now(WAT_TZ).isoformat(),
             'attempts': 5,
             'status': 'failed'
         }
 
-        # Load existing failed webhooks or start with empty list
-        existing_webhooks = []
-        if os.path.exists(FAILED_WEBHOOKS_FILE):
-            try:
-                with open(FAILED_WEBHOOKS_FILE, 'rb') as f:
-                    encrypted_data = f.read()
-                    existing_webhooks = decrypt_state_data(encrypted_data)
-                    if not isinstance(existing_webhooks, list):
-                        existing_webhooks = []
-            except Exception as e:
-                print(f"Warning: Could not load existing failed webhooks: {str(e)}")
-                existing_webhooks = []
-
-        # Append new failed webhook
-        existing_webhooks.append(failed_webhook)
-
-        # Encrypt and save updated list
-        encrypted_data = encrypt_state_data(existing_webhooks)
+        # Append-only queue: each failure is its own Fernet token on its own line, so
+        # queuing a failure never re-reads or re-encrypts the entries already there
+        encrypted_entry = encrypt_state_data(failed_webhook)
         os.makedirs(os.path.dirname(FAILED_WEBHOOKS_FILE), exist_ok=True)
-        with open(FAILED_WEBHOOKS_FILE, 'wb') as f:
-            f.write(encrypted_data)
+        with open(FAILED_WEBHOOKS_FILE, 'ab+') as f:
+            # A queue written before the append-only format is a single token with no
+            # trailing newline; start the new entry on its own line
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+            f.write(encrypted_entry + b'\n')
 
         print(f"Failed webhook saved to encrypted dead letter queue: {FAILED_WEBHOOKS_FILE}")
         return True
@@ -370,63 +482,107 @@ def save_failed_webhook(payload, error_msg, webhook_url):
         print(f"Error saving failed webhook to encrypted dead letter queue: {str(e)}")
         return False
 
-def check_failed_webhooks():
-    """Check and report on failed webhooks in the encrypted dead letter queue"""
-    try:
-        if not os.path.exists(FAILED_WEBHOOKS_FILE):
-            print("✅ No failed webhooks in queue")
-            return
+def load_failed_webhooks():
+    """Decrypt every entry in the dead letter queue (one Fernet token per line).
+
+    A line from the pre-append-only format holds a whole list of webhooks; it is
+    flattened into the result alongside the single-entry lines.
+    """
+    failed_webhooks = []
+    with open(FAILED_WEBHOOKS_FILE, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = decrypt_state_data(line)
+            if isinstance(entry, list):
+                failed_webhooks.extend(entry)
+            else:
+                failed_webhooks.append(entry)
+    return failed_webhooks
 
-        # Load and decrypt failed webhooks
-        with open(FAILED_WEBHOOKS_FILE, 'rb') as f:
-            encrypted_data = f.read()
-            failed_webhooks = decrypt_state_data(encrypted_data)
+def check_failed_webhooks():
+    """Check and report on failed webhooks in the encrypted dead letter queue.
 
-        if isinstance(failed_webhooks, list) and len(failed_webhooks) > 0:
-            failed_count = len(failed_webhooks)
-            print(f"⚠️  Warning: {failed_count} failed webhooks found in encrypted dead letter queue")
+    Only counts queued tokens (one per line) - nothing is decrypted on this path.
+    check_failed_webhooks.py decrypts the entries, and raises the state read failure
+    alert for an unreadable queue, in the workflow's alert step.
+    """
+    try:
+        try:
+            queue_size = os.path.getsize(FAILED_WEBHOOKS_FILE)
+        except FileNotFoundError:
+            queue_size = 0
+
+        failed_count = 0
+        if queue_size > 0:
+            with open(FAILED_WEBHOOKS_FILE, 'rb') as f:
+                last_chunk = b''
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    failed_count += chunk.count(b'\n')
+                    last_chunk = chunk
+            # A queue written before the append-only format has no trailing newline
+            if not last_chunk.endswith(b'\n'):
+                failed_count += 1
+
+        if failed_count > 0:
+            print(f"⚠️  Warning: {failed_count} failed webhook entries found in encrypted dead letter queue")
             print(f"Review failed webhooks at: {FAILED_WEBHOOKS_FILE}")
         else:
             print("✅ No failed webhooks in queue")
 
     except Exception as e:
         print(f"Error checking encrypted failed webhooks: {str(e)}")
-        # Save alert for state read failure if decryption fails
-        save_state_read_failure_alert(['failed_webhooks.enc'], str(e))
 
 
 def clear_failed_webhooks():
     """Remove failed webhooks file after successful delivery"""
     try:
-        if os.path.exists(FAILED_WEBHOOKS_FILE):
-            os.remove(FAILED_WEBHOOKS_FILE)
-            print("Cleared failed webhook queue")
+        os.remove(FAILED_WEBHOOKS_FILE)
+        print("Cleared failed webhook queue")
+    except FileNotFoundError:
+        pass
     except Exception as e:
         print(f"Error clearing failed webhook queue: {str(e)}")
 
 
+# Dropped or timed-out connections, truncated responses and token refreshes that never
+# reached Google. Not bare OSError: file errors and requests' HTTPError are OSErrors too.
+TRANSIENT_NETWORK_ERRORS = (ConnectionError, TimeoutError, socket.timeout, HTTPException,
+                            httplib2.HttpLib2Error, TransportError)
+
+def is_transient_api_error(exception):
+    """Retry only failures that can clear on their own: rate limits, 500/502/503/504
+    responses and network failures. Bad requests, auth errors and bugs fail fast."""
+    if isinstance(exception, TRANSIENT_NETWORK_ERRORS):
+        return True
+    return is_rate_limit_error(exception)
+
 @retry(
-    retry=retry_if_exception_type((HttpError, Exception)),
+    retry=retry_if_exception(is_transient_api_error),
     stop=stop_after_attempt(5),
-    wait=wait_exponential(multiplier=1, min=1, max=30),
-    before_sleep=lambda retry_state: print(f"Rate limit hit, retrying in {retry_state.next_action.sleep} seconds... (attempt {retry_state.attempt_number})")
+    # Exponential backoff plus jitter so concurrent runs don't retry in lockstep
+    wait=wait_exponential(multiplier=1, min=1, max=10) + wait_random(0.5, 2.0),
+    before_sleep=lambda retry_state: print(f"Transient API error, retrying in {retry_state.next_action.sleep:.1f} seconds... (attempt {retry_state.attempt_number})")
 )
 def robust_api_call(api_func, *args, **kwargs):
     """Execute API call with robust retry logic"""
+    return api_func(*args, **kwargs)
+
+def get_credentials():
+    """Load service account credentials for the Sheets API."""
     try:
-        return api_func(*args, **kwargs)
+        return service_account.Credentials.from_service_account_file(
+            SERVICE_ACCOUNT_FILE, scopes=SCOPES)
     except Exception as e:
-        if is_rate_limit_error(e):
-            # Add jitter to prevent thundering herd
-            time.sleep(random.uniform(0.5, 2.0))
-        raise
+        print(f"Error loading service account credentials: {str(e)}")
+        raise APIError("Failed to load service account credentials")
 
-def get_service():
+def get_service(credentials):
     """Create and return Google Sheets service object."""
     try:
-        credentials = service_account.Credentials.from_service_account_file(
-            SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-        return build('sheets', 'v4', credentials=credentials)
+        return build('sheets', 'v4', credentials=credentials,
+                     static_discovery=True, cache_discovery=False)
     except Exception as e:
         print(f"Error initializing Google Sheets service: {str(e)}")
         raise APIError("Failed to initialize Google Sheets service")
@@ -436,12 +592,13 @@ def get_sheet_data(service, sheet_name, range_name):
     print(f"Fetching data from sheet {sheet_name}...")
     try:
         def _fetch_data():
-            sheet = service.spreadsheets()
-            result = sheet.values().get(
+            result = service.spreadsheets().values().batchGet(
                 spreadsheetId=SPECIFICATION_SHEET_ID,
-                range=f'{sheet_name}!{range_name}'
+                ranges=[f'{sheet_name}!{range_name}'],
+                fields='valueRanges(values)'
             ).execute()
-            return result.get('values', [])
+            value_ranges = result.get('valueRanges', [])
+            return value_ranges[0].get('values', []) if value_ranges else []
 
         data = robust_api_call(_fetch_data)
 
@@ -459,38 +616,61 @@ def get_sheet_data(service, sheet_name, range_name):
         print(f"Unexpected error fetching sheet data: {str(e)}")
         raise APIError(f"Unexpected error while fetching data from {sheet_name}")
 
+def get_inventory_summary_data(service, http=None):
+    """Fetch the inventory summary sheet, shared across the inventory parsers.
+
+    Returns the rows, or None if the fetch fails (the parsers fall back to baselines).
+    Pass a dedicated http when calling from a worker thread: httplib2 connections are
+    not thread-safe, so concurrent requests must not share the service's transport.
+    """
+    def _fetch_summary_data():
+        result = service.spreadsheets().values().get(
+            spreadsheetId=INVENTORY_SHEET_ID,
+            range=f'{INVENTORY_SHEET_NAME}!{INVENTORY_RANGE}',
+            fields='values'
+        ).execute(http=http)
+        return result.get('values', [])
+
+    try:
+        return robust_api_call(_fetch_summary_data)
+    except Exception as e:
+        print(f"Error fetching inventory summary data: {str(e)}")
+        return None
+
 def load_previous_state(state_file):
     """Load previous state from encrypted file."""
     print(f"Checking for previous encrypted state file {state_file}")
     try:
-        if os.path.exists(state_file):
-            print(f"Loading and decrypting previous state from {state_file}")
+        try:
             with open(state_file, 'rb') as f:
                 encrypted_data = f.read()
-                data = decrypt_state_data(encrypted_data)
-
-                # Parts weight diff state holds a dict {product: diff} (check before the
-                # generic diff_state branch since the filename contains 'diff_state' too)
-                if 'parts_weight_diff' in state_file:
-                    if data is not None and not isinstance(data, dict):
-                        print("Invalid parts weight diff state data, treating as no previous state")
-                        return None
-                # Check if this is a difference state file (contains single value)
-                elif 'diff_state' in state_file:
-                    # Difference state files contain single numeric values
-                    if not isinstance(data, (int, float)) and data is not None:
-                        print("Invalid difference state data found, treating as no previous state")
-                        return None
-                else:
-                    # Balance state file expects 5 rows (multi-row header structure)
-                    min_rows = 5
-                    if not data or len(data) < min_rows:
-                        print(f"Invalid state data found (expected {min_rows} rows, got {len(data) if data else 0}), treating as no previous state")
-                        return None
-                print("Previous state loaded and decrypted successfully")
-                return data
-        print("No previous encrypted state file found")
-        return None
+        except FileNotFoundError:
+            print("No previous encrypted state file found")
+            return None
+
+        print(f"Loading and decrypting previous state from {state_file}")
+        data = decrypt_state_data(encrypted_data)
+
+        # Parts weight diff state holds a dict {product: diff} (check before the
+        # generic diff_state branch since the filename contains 'diff_state' too)
+        if 'parts_weight_diff' in state_file:
+            if data is not None and not isinstance(data, dict):
+                print("Invalid parts weight diff state data, treating as no previous state")
+                return None
+        # Check if this is a difference state file (contains single value)
+        elif 'diff_state' in state_file:
+            # Difference state files contain single numeric values
+            if not isinstance(data, (int, float)) and data is not None:
+                print("Invalid difference state data found, treating as no previous state")
+                return None
+        else:
+            # Balance state file expects 5 rows (multi-row header structure)
+            min_rows = 5
+            if not data or len(data) < min_rows:
+                print(f"Invalid state data found (expected {min_rows} rows, got {len(data) if data else 0}), treating as no previous state")
+                return None
+        print("Previous state loaded and decrypted successfully")
+        return data
     except Exception as e:
         print(f"Error loading/decrypting previous state: {str(e)}")
         # Save alert for state read failure
@@ -519,12 +699,26 @@ def save_current_state(state, state_file):
             print(f"Invalid state data (expected {min_rows} rows, got {len(state) if state else 0}), skipping save")
             return
 
+    # Fernet tokens differ on every encryption, so rewriting an unchanged state would
+    # still produce a new file (and a new commit on the encrypted-state branch)
+    # every run. Keep the existing file when it already holds this state - unless it
+    # is still a legacy pickle payload, which gets migrated to JSON once here.
+    # A missing or unreadable file simply counts as changed.
+    try:
+        with open(state_file, 'rb') as f:
+            decrypted_data = get_fernet().decrypt(f.read())
+        existing_state, is_legacy = decode_state_payload(decrypted_data)
+        unchanged = not is_legacy and existing_state == state
+    except Exception:
+        unchanged = False
+    if unchanged:
+        print(f"State unchanged, keeping existing {state_file}")
+        return
+
     print(f"Encrypting and saving current state to {state_file}")
     try:
-        os.makedirs(os.path.dirname(state_file), exist_ok=True)
         encrypted_data = encrypt_state_data(state)
-        with open(state_file, 'wb') as f:
-            f.write(encrypted_data)
+        write_state_file(state_file, encrypted_data)
         print(f"State encrypted and saved successfully to {state_file}")
     except Exception as e:
         print(f"Error encrypting/saving state: {str(e)}")
@@ -559,30 +753,28 @@ def detect_balance_changes(previous_data, current_data):
 
         print("\nComparing balance states...")
 
+        # Most runs see an untouched sheet: identical rows cannot produce a change,
+        # so skip parsing and per-cell comparison entirely
+        if previous_data == current_data:
+            print("No changes detected in balance")
+            return []
+
         # Parse both datasets
         prev_columns = parse_balance_data(previous_data)
         curr_columns = parse_balance_data(current_data)
 
-        # Create dictionaries for easy comparison
-        prev_dict = {}
-        for col in prev_columns:
-            key = f"{col['product']}|{col['grade']}|{col['metric']}"
-            prev_dict[key] = col['value']
+        # Create dictionaries for easy comparison, keyed by (product, grade, metric)
+        prev_dict = {(col['product'], col['grade'], col['metric']): col['value'] for col in prev_columns}
+        curr_dict = {(col['product'], col['grade'], col['metric']): col['value'] for col in curr_columns}
 
-        curr_dict = {}
-        for col in curr_columns:
-            key = f"{col['product']}|{col['grade']}|{col['metric']}"
-            curr_dict[key] = col['value']
-
-        # Detect changes
+        # Detect changes. parse_balance_data already returns stripped strings, so
+        # values compare directly without re-normalizing each cell here.
         changes = []
-        for key in curr_dict:
-            curr_val = str(curr_dict[key]).strip()
-            prev_val = str(prev_dict.get(key, "")).strip()
+        for key, curr_val in curr_dict.items():
+            prev_val = prev_dict.get(key, "")
 
             if prev_val != curr_val:
-                # Parse key back into components
-                product, grade, metric = key.split('|')
+                product, grade, metric = key
                 
                 # Skip Weight(kg) changes for whole chicken (weight is calculated from qty)
                 if 'WHOLE CHICKEN' in product and metric == 'Weight(kg)':
@@ -687,8 +879,26 @@ def detect_parts_weight_difference_changes(previous_parts_diff, current_parts_di
         print(f"Error detecting parts weight difference changes: {str(e)}")
         return changes
 
-def get_inventory_balance(data):
-    """Calculate inventory balance from pre-fetched summary sheet data."""
+def summary_header_index(headers):
+    """Map summary sheet column name -> index for a header row."""
+    return {name: idx for idx, name in enumerate(headers)}
+
+def index_rows_by_month(data_rows, year_month_col):
+    """Map year_month -> summary row in a single pass (first row wins, as a linear scan would).
+
+    Rows too short to have a year_month cell are skipped. The most recent month is
+    then simply max() over the keys.
+    """
+    rows_by_month = {}
+    for row in data_rows:
+        if len(row) > year_month_col:
+            rows_by_month.setdefault(row[year_month_col], row)
+    return rows_by_month
+
+def get_inventory_balance(data, header_index=None):
+    """Calculate inventory balance from pre-fetched summary sheet data.
+    Pass header_index (from summary_header_index) to reuse the one built for this fetch.
+    """
     try:
         if not data:
             print("No data found in inventory sheet, using baseline")
@@ -699,34 +909,27 @@ def get_inventory_balance(data):
             print("Not enough rows in inventory sheet, using baseline")
             return BASELINE_WC_QTY if BASELINE_WC_QTY > 0 else None
             
-        headers = data[0]
-        try:
-            balance_col_index = headers.index('whole_chicken_quantity_stock_balance')
-            year_month_col_index = headers.index('year_month')
-        except ValueError as e:
-            raise MissingColumnError(f"Required column missing from inventory summary sheet: {str(e)}")
-            
+        if header_index is None:
+            header_index = summary_header_index(data[0])
+        for required in ('whole_chicken_quantity_stock_balance', 'year_month'):
+            if required not in header_index:
+                raise MissingColumnError(f"{required} column missing from inventory summary sheet")
+        balance_col_index = header_index['whole_chicken_quantity_stock_balance']
+        year_month_col_index = header_index['year_month']
+
         # Get current year-month in YYYY-MM format
-        current_date = datetime.now(pytz.UTC).astimezone(pytz.timezone('Africa/Lagos'))
+        current_date = datetime.now(WAT_TZ)
         current_year_month = current_date.strftime('%Y-%m')
-        
-        # Find the row for the current month
-        data_rows = data[1:]  # Skip header row
-        current_month_row = None
-        
-        for row in data_rows:
-            if len(row) > year_month_col_index and row[year_month_col_index] == current_year_month:
-                current_month_row = row
-                break
-        
+
+        # Index rows by year_month once
+        rows_by_month = index_rows_by_month(data[1:], year_month_col_index)  # Skip header row
+        current_month_row = rows_by_month.get(current_year_month)
+
         if not current_month_row:
             print(f"Warning: No data found for current month ({current_year_month})")
-            # Sort by year_month in descending order to get the most recent record as fallback
-            sorted_data = sorted(data_rows, 
-                               key=lambda x: x[year_month_col_index] if len(x) > year_month_col_index else '', 
-                               reverse=True)
-            if sorted_data:
-                current_month_row = sorted_data[0]
+            # Fall back to the most recent year_month on the sheet
+            if rows_by_month:
+                current_month_row = rows_by_month[max(rows_by_month)]
                 print(f"Using most recent available data from {current_month_row[year_month_col_index]}")
             else:
                 print("No data rows found, using baseline")
@@ -751,7 +954,7 @@ def get_inventory_balance(data):
         # Return baseline on error so comparison can still work
         return BASELINE_WC_QTY if BASELINE_WC_QTY > 0 else None
 
-def get_gizzard_inventory_balance(data):
+def get_gizzard_inventory_balance(data, header_index=None):
     """Extract gizzard packs and weight balance from pre-fetched summary sheet data.
     Returns: Tuple of (packs_balance, weight_balance)
     """
@@ -765,53 +968,40 @@ def get_gizzard_inventory_balance(data):
             print("Not enough rows in inventory sheet for gizzard, using baseline")
             return BASELINE_GIZZARD_PACKS, BASELINE_GIZZARD_WEIGHT
 
-        headers = data[0]
-
-        # Try to find both packs and weight columns
-        gizzard_packs_col = None
-        gizzard_weight_col = None
-        year_month_col = None
+        # Look up the year_month, packs and weight columns in the header index
+        if header_index is None:
+            header_index = summary_header_index(data[0])
 
-        try:
-            year_month_col = headers.index('year_month')
-        except ValueError:
+        year_month_col = header_index.get('year_month')
+        if year_month_col is None:
             raise MissingColumnError("year_month column missing from inventory summary sheet")
 
         # Check for gizzard quantity/packs column
-        try:
-            gizzard_packs_col = headers.index('gizzard_quantity_stock_balance')
+        gizzard_packs_col = header_index.get('gizzard_quantity_stock_balance')
+        if gizzard_packs_col is not None:
             print("Found gizzard_quantity_stock_balance column")
-        except ValueError:
+        else:
             print("gizzard_quantity_stock_balance column not found (this is OK if not tracked)")
 
         # Check for gizzard weight column
-        try:
-            gizzard_weight_col = headers.index('gizzard_weight_stock_balance')
-            print("Found gizzard_weight_stock_balance column")
-        except ValueError:
+        gizzard_weight_col = header_index.get('gizzard_weight_stock_balance')
+        if gizzard_weight_col is None:
             raise MissingColumnError("gizzard_weight_stock_balance column missing from inventory summary sheet")
+        print("Found gizzard_weight_stock_balance column")
 
         # Get current year-month in YYYY-MM format
-        current_date = datetime.now(pytz.UTC).astimezone(pytz.timezone('Africa/Lagos'))
+        current_date = datetime.now(WAT_TZ)
         current_year_month = current_date.strftime('%Y-%m')
 
         # Find the row for the current month
-        data_rows = data[1:]  # Skip header row
-        current_month_row = None
-
-        for row in data_rows:
-            if len(row) > year_month_col and row[year_month_col] == current_year_month:
-                current_month_row = row
-                break
+        rows_by_month = index_rows_by_month(data[1:], year_month_col)  # Skip header row
+        current_month_row = rows_by_month.get(current_year_month)
 
         if not current_month_row:
             print(f"Warning: No data found for current month ({current_year_month}) for gizzard")
-            # Sort by year_month in descending order to get the most recent record as fallback
-            sorted_data = sorted(data_rows,
-                               key=lambda x: x[year_month_col] if len(x) > year_month_col else '',
-                               reverse=True)
-            if sorted_data:
-                current_month_row = sorted_data[0]
+            # Fall back to the most recent year_month on the sheet
+            if rows_by_month:
+                current_month_row = rows_by_month[max(rows_by_month)]
                 print(f"Using most recent available data from {current_month_row[year_month_col]} for gizzard")
             else:
                 print("No data rows found for gizzard, using baseline")
@@ -850,7 +1040,7 @@ def get_gizzard_inventory_balance(data):
             return BASELINE_GIZZARD_PACKS, BASELINE_GIZZARD_WEIGHT
         return None, None
 
-def get_parts_inventory_weights(data):
+def get_parts_inventory_weights(data, header_index=None):
     """Extract weight stock balance for the reconciled parts (WEIGHT_RECON_PARTS plus any
     extra members referenced only by a combined group, e.g. HEAD & LEG).
 
@@ -866,40 +1056,34 @@ def get_parts_inventory_weights(data):
             print("Not enough rows in inventory sheet for parts weight, skipping")
             return results
 
-        headers = data[0]
-        if 'year_month' not in headers:
+        if header_index is None:
+            header_index = summary_header_index(data[0])
+        if 'year_month' not in header_index:
             # year_month integrity is already enforced by the gizzard fetch; skip gracefully here
             print("year_month column not found for parts weight, skipping")
             return results
-        year_month_col = headers.index('year_month')
+        year_month_col = header_index['year_month']
 
-        current_date = datetime.now(pytz.UTC).astimezone(pytz.timezone('Africa/Lagos'))
+        current_date = datetime.now(WAT_TZ)
         current_year_month = current_date.strftime('%Y-%m')
 
-        data_rows = data[1:]
-        current_month_row = None
-        for row in data_rows:
-            if len(row) > year_month_col and row[year_month_col] == current_year_month:
-                current_month_row = row
-                break
+        rows_by_month = index_rows_by_month(data[1:], year_month_col)
+        current_month_row = rows_by_month.get(current_year_month)
 
         if not current_month_row:
             print(f"Warning: No data found for current month ({current_year_month}) for parts weight")
-            sorted_data = sorted(data_rows,
-                                 key=lambda x: x[year_month_col] if len(x) > year_month_col else '',
-                                 reverse=True)
-            if not sorted_data:
+            if not rows_by_month:
                 print("No data rows found for parts weight, skipping")
                 return results
-            current_month_row = sorted_data[0]
+            current_month_row = rows_by_month[max(rows_by_month)]
             print(f"Using most recent available data from {current_month_row[year_month_col]} for parts weight")
 
         for name, key in targets.items():
             col_name = f'{key}_weight_stock_balance'
-            if col_name not in headers:
+            col_idx = header_index.get(col_name)
+            if col_idx is None:
                 print(f"{col_name} not found in summary sheet (skipping {name})")
                 continue
-            col_idx = headers.index(col_name)
             if len(current_month_row) > col_idx:
                 try:
                     results[name] = float(current_month_row[col_idx]) + PARTS_WEIGHT_BASELINE.get(name, 0)
@@ -910,86 +1094,87 @@ def get_parts_inventory_weights(data):
         print(f"Error fetching parts inventory weights: {str(e)}")
         return results
 
-def calculate_part_spec_weight(parsed_columns, product_name):
-    """Sum Weight(kg) across all grades for a product from the Balance (spec) sheet."""
-    total = 0.0
+def calculate_part_spec_weights(parsed_columns):
+    """Sum Weight(kg) across all grades for every product on the Balance (spec) sheet.
+
+    Built in one pass so the reconciliation rows and groups look products up in a dict
+    instead of rescanning every column once per part.
+    Returns: dict mapping product name -> total weight (products without weight are absent)
+    """
+    totals = {}
     for col in parsed_columns:
-        if col['product'] == product_name and col['metric'] == 'Weight(kg)' and col['value']:
-            try:
-                total += float(str(col['value']).replace(',', ''))
-            except (ValueError, TypeError):
-                continue
-    return total
+        if col['metric'] == 'Weight(kg)' and col['number'] is not None:
+            totals[col['product']] = totals.get(col['product'], 0.0) + col['number']
+    return totals
 
-def calculate_total_pieces(stock_data):
+def summarize_balance_totals(parsed_columns):
     """
-    Calculate total whole chicken pieces from stock data across ALL grades and weight ranges.
-    Uses the new multi-row header structure.
+    Sum whole chicken Qty (all grades and weight ranges) and gizzard Packs / Weight(kg)
+    in a single pass over the parsed Balance columns.
+    Returns: Tuple of (total_pieces, gizzard_packs, gizzard_weight)
     """
-    try:
-        # Parse the balance data
-        parsed_columns = parse_balance_data(stock_data)
+    total_pieces = 0
+    gizzard_packs = 0
+    gizzard_weight = 0
 
-        total = 0
+    for col in parsed_columns:
+        product = col['product']
+        metric = col['metric']
+        if 'WHOLE CHICKEN' in product:
+            if metric != 'Qty':
+                continue
+        elif product != 'GIZZARD' or metric not in ('Packs', 'Weight(kg)'):
+            continue
 
-        # Sum all whole chicken Qty columns across all grades and weight ranges
-        for col in parsed_columns:
-            product = col['product']
-            metric = col['metric']
-            value = col['value']
+        amount = col['number']
+        if amount is None:
+            continue
 
-            # Only count whole chicken quantities
-            if 'WHOLE CHICKEN' in product and metric == 'Qty':
-                try:
-                    qty = float(value) if value else 0
-                    total += qty
-                except (ValueError, TypeError):
-                    continue
+        if metric == 'Qty':
+            total_pieces += amount
+        elif metric == 'Packs':
+            gizzard_packs += amount
+        else:
+            gizzard_weight += amount
+
+    return int(total_pieces), gizzard_packs, gizzard_weight
 
-        return int(total)
+def calculate_total_pieces(stock_data, parsed_columns=None):
+    """
+    Calculate total whole chicken pieces from stock data across ALL grades and weight ranges.
+    Uses the new multi-row header structure. Pass parsed_columns to reuse an existing parse.
+    """
+    try:
+        if parsed_columns is None:
+            parsed_columns = parse_balance_data(stock_data)
+        total_pieces, _packs, _weight = summarize_balance_totals(parsed_columns)
+        return total_pieces
     except Exception as e:
         print(f"Error calculating total pieces: {str(e)}")
         return None
 
-def calculate_current_differences(stock_data, inventory_balance, gizzard_inventory_packs, gizzard_inventory_weight):
+def calculate_current_differences(stock_data, inventory_balance, gizzard_inventory_packs, gizzard_inventory_weight, parsed_columns=None, balance_totals=None):
     """Calculate current inventory balance differences.
+    balance_totals is an optional summarize_balance_totals() result to reuse.
     Returns: Tuple of (whole_chicken_diff, gizzard_packs_diff, gizzard_weight_diff)
     """
     try:
+        if balance_totals is None:
+            if parsed_columns is None:
+                parsed_columns = parse_balance_data(stock_data)
+            balance_totals = summarize_balance_totals(parsed_columns)
+
+        # Whole chicken pieces and gizzard packs/weight come from one pass over the columns
+        total_pieces, current_gizzard_packs, current_gizzard_weight = balance_totals
+
         # Calculate whole chicken difference
-        total_pieces = calculate_total_pieces(stock_data)
         whole_chicken_diff = None
-        if total_pieces is not None and inventory_balance is not None:
+        if inventory_balance is not None:
             whole_chicken_diff = int(total_pieces - inventory_balance)
 
-        # Calculate gizzard differences - sum all gizzard packs and weight across all grades
-        parsed_columns = parse_balance_data(stock_data)
-        current_gizzard_packs = 0
-        current_gizzard_weight = 0
         gizzard_packs_diff = None
         gizzard_weight_diff = None
 
-        for col in parsed_columns:
-            product = col['product']
-            metric = col['metric']
-            value = col['value']
-
-            # Sum all gizzard packs
-            if product == 'GIZZARD' and metric == 'Packs':
-                try:
-                    packs = float(value) if value else 0
-                    current_gizzard_packs += packs
-                except (ValueError, TypeError):
-                    continue
-
-            # Sum all gizzard weights
-            if product == 'GIZZARD' and metric == 'Weight(kg)':
-                try:
-                    weight = float(value) if value else 0
-                    current_gizzard_weight += weight
-                except (ValueError, TypeError):
-                    continue
-
         # Calculate packs difference
         if current_gizzard_packs > 0 and gizzard_inventory_packs is not None:
             gizzard_packs_diff = current_gizzard_packs - gizzard_inventory_packs
@@ -1003,25 +1188,96 @@ def calculate_current_differences(stock_data, inventory_balance, gizzard_invento
         print(f"Error calculating current differences: {str(e)}")
         return None, None, None
 
-def calculate_parts_weight_differences(stock_data, parts_inventory_weights):
+def calculate_parts_weight_differences(stock_data, parts_inventory_weights, parsed_columns=None):
     """Return a dict {product_name: spec_weight - inventory_weight} for reconciled parts.
 
     Only parts that have an inventory value and a positive spec weight are included.
     """
     diffs = {}
     try:
-        parsed_columns = parse_balance_data(stock_data)
+        if parsed_columns is None:
+            parsed_columns = parse_balance_data(stock_data)
+        spec_weights = calculate_part_spec_weights(parsed_columns)
         for name, _key, _label in WEIGHT_RECON_PARTS:
             inv = parts_inventory_weights.get(name) if parts_inventory_weights else None
             if inv is None:
                 continue
-            spec = calculate_part_spec_weight(parsed_columns, name)
+            spec = spec_weights.get(name, 0.0)
             if spec > 0:
                 diffs[name] = spec - inv
     except Exception as e:
         print(f"Error calculating parts weight differences: {str(e)}")
     return diffs
 
+@lru_cache(maxsize=None)
+def whole_chicken_weight_range(product):
+    """Weight range of a whole chicken product ('WHOLE CHICKEN - 1.2KG' -> '1.2KG'),
+    or None for any other product. Memoized: the Balance sheet only has a few dozen
+    product names, but they are categorized once per column and per change."""
+    if 'WHOLE CHICKEN' not in product:
+        return None
+    return product.replace('WHOLE CHICKEN - ', '')
+
+# Any "(Standard <product>)" suffix is stripped generically so new products
+# don't need a code change here
+GRADE_SUFFIX_PATTERN = re.compile(r'\s*\(Standard [^)]*\)')
+
+@lru_cache(maxsize=None)
+def grade_display_name(grade):
+    """Grade label without its "(Standard <product>)" suffix, e.g. 'Grade A (Standard Bird)' -> 'Grade A'.
+    Cached: the sheet only has a handful of distinct grade labels.
+    """
+    return GRADE_SUFFIX_PATTERN.sub('', grade).strip()
+
+# Mobile-friendly abbreviations used in alert text
+GRADE_ABBREVIATIONS = {'Grade A': 'GA', 'Grade B': 'GB', 'Grade C': 'GC', 'Grade D': 'GD'}
+METRIC_ABBREVIATIONS = {'Qty': 'Q', 'Weight(kg)': 'W(kg)', 'Packs': 'P'}
+
+# Balance-sheet product -> change group shown in the alert. Whole chicken weight
+# ranges all fold into 'WC'; unlisted products fall back to product.title().
+PRODUCT_GROUPS = {
+    'GIZZARD': 'Gizzard',
+    'WINGS': 'Wings',
+    'LAPS': 'Laps',
+    'BREAST': 'Breast',
+    'FILLET': 'Fillet',
+    'BONES': 'Bones',
+    'CUT 4': 'Cut 4',
+    'HEAD & LEG': 'Head & Leg',
+    'NECK': 'Neck',
+    'LIVER': 'Liver',
+    'HEAD': 'Head',
+    'LEG': 'Leg',
+}
+
+# Display order of change groups: WC, then the parts in PRODUCT_GROUPS order;
+# any other group is listed after these
+PRODUCT_GROUP_ORDER = ('WC', *PRODUCT_GROUPS.values())
+KNOWN_PRODUCT_GROUPS = frozenset(PRODUCT_GROUP_ORDER)
+
+def plural_suffix(count, singular, plural):
+    """Pick the singular unit for a count of exactly +/-1, the plural otherwise."""
+    return singular if abs(count) == 1 else plural
+
+def format_qty_value(num):
+    """Quantity as pieces (abbreviated: pc/pcs)."""
+    return f"{int(num):,}{plural_suffix(num, 'pc', 'pcs')}"
+
+def format_weight_value(num):
+    """Weight as kg."""
+    return f"{num:,.2f}kg"
+
+def format_packs_value(num):
+    """Packs (abbreviated: pk/pks)."""
+    return f"{num:,.1f}{plural_suffix(num, 'pk', 'pks')}"
+
+# Metric -> formatter for a parsed cell value; other metrics are shown as-is
+VALUE_FORMATTERS = {
+    'Qty': format_qty_value,
+    'Weight(kg)': format_weight_value,
+    'Packs': format_packs_value,
+}
+
 def format_change_description(change, include_product=True):
     """
     Format a single change object into readable text.
@@ -1039,81 +1295,41 @@ def format_change_description(change, include_product=True):
     new_val = change['new_value']
 
     # Extract weight range for whole chicken
-    weight_range = ""
-    product_display = ""
+    weight_range = whole_chicken_weight_range(product)
 
     if include_product:
-        if 'WHOLE CHICKEN' in product:
-            weight_range = product.replace('WHOLE CHICKEN - ', '')
+        if weight_range is not None:
             product_display = f"WC-{weight_range} "  # Abbreviated: WC instead of Whole Chicken
         else:
             product_display = f"{product.title()} "
     else:
         # When not including product, just show weight range for WC
-        if 'WHOLE CHICKEN' in product:
-            weight_range = product.replace('WHOLE CHICKEN - ', '')
+        if weight_range is not None:
             product_display = f"{weight_range} "
         else:
             # For other products (Gizzard, Wings, etc.), no prefix needed since it's in the group header
             product_display = ""
 
-    # Format grade display with abbreviations
-    # Strip any "(Standard <product>)" suffix generically so new products
-    # don't need a code change here
-    grade_clean = re.sub(r'\s*\(Standard [^)]*\)', '', grade).strip()
-
-    # Abbreviate grades: Grade A -> GA, Grade B -> GB, etc.
-    if grade_clean == 'Grade A':
-        grade_display = 'GA'
-    elif grade_clean == 'Grade B':
-        grade_display = 'GB'
-    elif grade_clean == 'Grade C':
-        grade_display = 'GC'
-    elif grade_clean == 'Grade D':
-        grade_display = 'GD'
-    else:
-        grade_display = grade_clean
+    # Format grade display with abbreviations: Grade A -> GA, Grade B -> GB, etc.
+    grade_clean = grade_display_name(grade)
+    grade_display = GRADE_ABBREVIATIONS.get(grade_clean, grade_clean)
 
     # Abbreviate metrics: Qty -> Q, Weight(kg) -> W(kg), Packs -> P
-    if metric == 'Qty':
-        metric_display = 'Q'
-    elif metric == 'Weight(kg)':
-        metric_display = 'W(kg)'
-    elif metric == 'Packs':
-        metric_display = 'P'
-    else:
-        metric_display = metric
+    metric_display = METRIC_ABBREVIATIONS.get(metric, metric)
 
-    # Format values based on metric
-    try:
-        if metric == 'Qty':
-            # Quantity - format as pieces (abbreviated: pc/pcs)
-            old_num = float(old_val) if old_val else 0
-            new_num = float(new_val) if new_val else 0
-            old_suffix = "pc" if abs(old_num) == 1 else "pcs"
-            new_suffix = "pc" if abs(new_num) == 1 else "pcs"
-            old_str = f"{int(old_num):,}{old_suffix}"
-            new_str = f"{int(new_num):,}{new_suffix}"
-        elif metric == 'Weight(kg)':
-            # Weight - format as kg
-            old_num = float(old_val) if old_val else 0
-            new_num = float(new_val) if new_val else 0
-            old_str = f"{old_num:,.2f}kg"
-            new_str = f"{new_num:,.2f}kg"
-        elif metric == 'Packs':
-            # Packs - format as packs (abbreviated: pk/pks)
-            old_num = float(old_val) if old_val else 0
-            new_num = float(new_val) if new_val else 0
-            old_suffix = "pk" if abs(old_num) == 1 else "pks"
-            new_suffix = "pk" if abs(new_num) == 1 else "pks"
-            old_str = f"{old_num:,.1f}{old_suffix}"
-            new_str = f"{new_num:,.1f}{new_suffix}"
-        else:
-            old_str = str(old_val)
-            new_str = str(new_val)
-    except (ValueError, TypeError):
+    # Format values based on metric; non-numeric cells and unknown metrics are shown as-is
+    formatter = VALUE_FORMATTERS.get(metric)
+    old_num = new_num = None
+    if formatter is not None:
+        old_num = parse_number(old_val) if old_val else 0
+        new_num = parse_number(new_val) if new_val else 0
+
+    if old_num is None or new_num is None:
         old_str = str(old_val)
         new_str = str(new_val)
+    else:
+        old_str = formatter(old_num)
+        new_str = formatter(new_num)
 
     # Build the text and ensure it's not empty
     text = f"• {product_display}{grade_display} {metric_display}: {old_str}→{new_str}".strip()
@@ -1124,8 +1340,11 @@ def format_change_description(change, include_product=True):
 
     return text
 
+@lru_cache(maxsize=None)
 def get_weight_per_piece(category_name):
-    """Get weight per piece for a given category and whether it's an approximation."""
+    """Get weight per piece for a given category and whether it's an approximation.
+    Cached: the same handful of weight categories are looked up on every alert.
+    """
     category_lower = category_name.lower()
     
     if 'below' in category_lower and '1kg' in category_lower:
@@ -1148,6 +1367,30 @@ def get_weight_per_piece(category_name):
     # Default fallback (shouldn't happen with proper data)
     return 1.0, True, "1kg/piece"
 
+def decorated_text(text, icon=None):
+    """Build a Google Chat decoratedText widget, optionally with a known start icon."""
+    widget = {"text": text}
+    if icon:
+        widget["startIcon"] = {"knownIcon": icon}
+    return {"decoratedText": widget}
+
+def text_paragraph(text):
+    """Build a Google Chat textParagraph widget (renders multi-line text)."""
+    return {"textParagraph": {"text": text}}
+
+# Discrepancy severity -> status color for reconciliation rows, and the card
+# subtitle prefix for the overall severity (LOW keeps the plain "Updated:" subtitle)
+SEVERITY_COLORS = {'HIGH': '#EA4335', 'MEDIUM': '#FBBC04', 'LOW': '#FF6D00'}  # red, yellow, orange
+SEVERITY_SUBTITLE_PREFIXES = {'HIGH': '🔴 HIGH PRIORITY', 'MEDIUM': '🟡 MEDIUM PRIORITY'}
+
+def discrepancy_severity(abs_diff, high_threshold, med_threshold):
+    """Classify an absolute discrepancy as 'HIGH', 'MEDIUM' or 'LOW' against the given thresholds."""
+    if abs_diff > high_threshold:
+        return "HIGH"
+    if abs_diff > med_threshold:
+        return "MEDIUM"
+    return "LOW"
+
 def build_reconciliation_row(label, spec, inv, unit, high_threshold, med_threshold):
     """Build one compact spec-vs-inventory row widget.
 
@@ -1169,16 +1412,10 @@ def build_reconciliation_row(label, spec, inv, unit, high_threshold, med_thresho
     if matched:
         status = '<font color="#0F9D58">✅</font>'
     else:
-        abs_diff = abs(diff)
-        if abs_diff > high_threshold:
-            color = "#EA4335"  # red
-        elif abs_diff > med_threshold:
-            color = "#FBBC04"  # yellow
-        else:
-            color = "#FF6D00"  # orange
+        color = SEVERITY_COLORS[discrepancy_severity(abs(diff), high_threshold, med_threshold)]
         status = f'<font color="{color}">⚠️ {diff_s}</font>'
 
-    return {"decoratedText": {"text": f"<b>{label}:</b> {spec_s} / {inv_s} {unit} {status}"}}
+    return decorated_text(f"<b>{label}:</b> {spec_s} / {inv_s} {unit} {status}")
 
 def enforce_widget_budget(sections, limit=95):
     """Keep the card under Google Chat's 100-widget cap (a section that crosses 100 and
@@ -1202,35 +1439,38 @@ def enforce_widget_budget(sections, limit=95):
 
     sections = [s for s in sections if s.get("widgets")]
     if trimmed and sections:
-        sections[-1]["widgets"].append({
-            "decoratedText": {"text": "<i>… some details trimmed to fit. See the spec sheet for the full breakdown.</i>"}
-        })
+        sections[-1]["widgets"].append(
+            decorated_text("<i>… some details trimmed to fit. See the spec sheet for the full breakdown.</i>")
+        )
     return sections
 
-def build_card_alert(balance_changes, balance_data, inventory_balance, gizzard_inventory_packs, gizzard_inventory_weight, chicken_difference_changes, gizzard_difference_changes, parts_inventory_weights=None, parts_difference_changes=None):
+def build_card_alert(balance_changes, balance_data, inventory_balance, gizzard_inventory_packs, gizzard_inventory_weight, chicken_difference_changes, gizzard_difference_changes, parts_inventory_weights=None, parts_difference_changes=None, parsed_columns=None, balance_totals=None):
     """Build a comprehensive Google Chat card with all inventory information."""
 
     # Get current time
-    wat_tz = pytz.timezone('Africa/Lagos')
-    current_time = datetime.now(pytz.UTC).astimezone(wat_tz)
+    current_time = datetime.now(WAT_TZ)
     timestamp = current_time.strftime('%Y-%m-%d %I:%M:%S %p WAT')
 
-    parsed_columns = parse_balance_data(balance_data)
-    total_pieces = calculate_total_pieces(balance_data)
+    # Parse once and share the columns with every section builder below
+    if parsed_columns is None:
+        parsed_columns = parse_balance_data(balance_data)
 
-    # Calculate severity level for color coding
-    chicken_discrepancy = 0
-    gizzard_packs_discrepancy = 0
-    gizzard_weight_discrepancy = 0
+    # Whole chicken pieces and current gizzard packs/weight from the Balance sheet,
+    # reusing the totals main() already computed for the differences when given
+    if balance_totals is None:
+        balance_totals = summarize_balance_totals(parsed_columns)
+    total_pieces, current_gizzard_packs, current_gizzard_weight = balance_totals
 
+    # WC spec-vs-inventory difference, computed once for both the severity and the
+    # reconciliation row (None when there is nothing to compare)
+    chicken_diff = None
     if inventory_balance is not None and total_pieces > 0:
-        chicken_discrepancy = abs(int(total_pieces - inventory_balance))
+        chicken_diff = int(total_pieces - inventory_balance)
 
-    # Calculate current gizzard values from Balance sheet
-    current_gizzard_packs = sum(float(col['value']) for col in parsed_columns
-                                 if col['product'] == 'GIZZARD' and col['metric'] == 'Packs')
-    current_gizzard_weight = sum(float(col['value']) for col in parsed_columns
-                                  if col['product'] == 'GIZZARD' and col['metric'] == 'Weight(kg)')
+    # Calculate severity level for color coding
+    chicken_discrepancy = abs(chicken_diff) if chicken_diff is not None else 0
+    gizzard_packs_discrepancy = 0
+    gizzard_weight_discrepancy = 0
 
     if gizzard_inventory_packs is not None and current_gizzard_packs > 0:
         gizzard_packs_discrepancy = abs(current_gizzard_packs - gizzard_inventory_packs)
@@ -1242,11 +1482,12 @@ def build_card_alert(balance_changes, balance_data, inventory_balance, gizzard_i
     # HIGH: >100 chicken pieces or >100 gizzard packs or >50kg gizzard weight discrepancy
     # MEDIUM: >50 chicken pieces or >50 gizzard packs or >20kg gizzard weight discrepancy
     # LOW: anything else with changes
-    severity = "LOW"
-    if chicken_discrepancy > 100 or gizzard_packs_discrepancy > 100 or gizzard_weight_discrepancy > 50:
-        severity = "HIGH"
-    elif chicken_discrepancy > 50 or gizzard_packs_discrepancy > 50 or gizzard_weight_discrepancy > 20:
-        severity = "MEDIUM"
+    severities = {
+        discrepancy_severity(chicken_discrepancy, 100, 50),
+        discrepancy_severity(gizzard_packs_discrepancy, 100, 50),
+        discrepancy_severity(gizzard_weight_discrepancy, 50, 20),
+    }
+    severity = "HIGH" if "HIGH" in severities else "MEDIUM" if "MEDIUM" in severities else "LOW"
 
     # Build card sections
     sections = []
@@ -1254,11 +1495,11 @@ def build_card_alert(balance_changes, balance_data, inventory_balance, gizzard_i
     # Section 0: Baseline Reference (Stock Count)
     if BASELINE_WC_QTY > 0 or BASELINE_GIZZARD_PACKS > 0 or BASELINE_LAPS_WEIGHT > 0:
         baseline_widgets = [
-            {"decoratedText": {"text": f"WC: <b>{int(BASELINE_WC_QTY):,}pcs</b> / <b>{BASELINE_WC_WEIGHT:,.2f}kg</b>"}},
-            {"decoratedText": {"text": f"Gizzard: <b>{int(BASELINE_GIZZARD_PACKS)}pks</b> / <b>{BASELINE_GIZZARD_WEIGHT:.2f}kg</b>"}}
+            decorated_text(f"WC: <b>{int(BASELINE_WC_QTY):,}pcs</b> / <b>{BASELINE_WC_WEIGHT:,.2f}kg</b>"),
+            decorated_text(f"Gizzard: <b>{int(BASELINE_GIZZARD_PACKS)}pks</b> / <b>{BASELINE_GIZZARD_WEIGHT:.2f}kg</b>")
         ]
         if BASELINE_LAPS_WEIGHT > 0:
-            baseline_widgets.append({"decoratedText": {"text": f"Laps: <b>{BASELINE_LAPS_WEIGHT:.2f}kg</b>"}})
+            baseline_widgets.append(decorated_text(f"Laps: <b>{BASELINE_LAPS_WEIGHT:.2f}kg</b>"))
         sections.append({
             "header": "📦 Baseline (Stock Count)",
             "widgets": baseline_widgets
@@ -1269,7 +1510,7 @@ def build_card_alert(balance_changes, balance_data, inventory_balance, gizzard_i
     recon_widgets = []
 
     # Whole chicken (pieces)
-    if inventory_balance is not None and total_pieces > 0:
+    if chicken_diff is not None:
         recon_widgets.append(build_reconciliation_row('WC', total_pieces, inventory_balance, 'pcs', 100, 50))
 
     # Gizzard (weight)
@@ -1277,11 +1518,12 @@ def build_card_alert(balance_changes, balance_data, inventory_balance, gizzard_i
         recon_widgets.append(build_reconciliation_row('Gizzard', current_gizzard_weight, gizzard_inventory_weight, 'kg', 50, 20))
 
     # Other reconciled parts (weight)
+    spec_weights = calculate_part_spec_weights(parsed_columns)
     for name, _key, label in WEIGHT_RECON_PARTS:
         inv_weight = parts_inventory_weights.get(name) if parts_inventory_weights else None
         if inv_weight is None:
             continue
-        spec_weight = calculate_part_spec_weight(parsed_columns, name)
+        spec_weight = spec_weights.get(name, 0.0)
         if spec_weight > 0:
             recon_widgets.append(build_reconciliation_row(label, spec_weight, inv_weight, 'kg', 50, 20))
 
@@ -1293,16 +1535,16 @@ def build_card_alert(balance_changes, balance_data, inventory_balance, gizzard_i
         invs = [parts_inventory_weights.get(n) if parts_inventory_weights else None for n, _ in members]
         if any(v is None for v in invs):
             continue
-        spec_total = sum(calculate_part_spec_weight(parsed_columns, n) for n, _ in members)
+        spec_total = sum(spec_weights.get(n, 0.0) for n, _ in members)
         inv_total = sum(invs)
         if spec_total > 0:
             group_widgets.append(build_reconciliation_row(label, spec_total, inv_total, 'kg', 50, 20))
     if group_widgets:
-        recon_widgets.append({"decoratedText": {"text": "<i>combined</i>"}})
+        recon_widgets.append(decorated_text("<i>combined</i>"))
         recon_widgets.extend(group_widgets)
 
     if recon_widgets:
-        recon_widgets.insert(0, {"decoratedText": {"text": "<i>spec / inventory</i>"}})
+        recon_widgets.insert(0, decorated_text("<i>spec / inventory</i>"))
         sections.append({
             "header": "📊 Stock vs Inventory",
             "widgets": recon_widgets
@@ -1315,92 +1557,40 @@ def build_card_alert(balance_changes, balance_data, inventory_balance, gizzard_i
         # Balance changes summary - grouped by product
         if balance_changes:
             change_count_text = f"🔄 {len(balance_changes)} balance change(s) detected"
-            change_widgets.append({
-                "decoratedText": {
-                    "text": f"<b>{change_count_text}</b>"
-                }
-            })
+            change_widgets.append(decorated_text(f"<b>{change_count_text}</b>"))
 
             # Group changes by product type
-            grouped_changes = {}
+            grouped_changes = defaultdict(list)
             for change in balance_changes:
                 product = change['product']
-
-                # Determine product group
                 if 'WHOLE CHICKEN' in product:
                     group = 'WC'
-                elif product == 'GIZZARD':
-                    group = 'Gizzard'
-                elif product == 'WINGS':
-                    group = 'Wings'
-                elif product == 'LAPS':
-                    group = 'Laps'
-                elif product == 'BREAST':
-                    group = 'Breast'
-                elif product == 'FILLET':
-                    group = 'Fillet'
-                elif product == 'BONES':
-                    group = 'Bones'
-                elif product == 'CUT 4':
-                    group = 'Cut 4'
-                elif product == 'HEAD & LEG':
-                    group = 'Head & Leg'
-                elif product == 'NECK':
-                    group = 'Neck'
-                elif product == 'LIVER':
-                    group = 'Liver'
-                elif product == 'HEAD':
-                    group = 'Head'
-                elif product == 'LEG':
-                    group = 'Leg'
                 else:
-                    group = product.title()
-
-                if group not in grouped_changes:
-                    grouped_changes[group] = []
+                    group = PRODUCT_GROUPS.get(product) or product.title()
                 grouped_changes[group].append(change)
 
             # Display changes by group, one consolidated textParagraph per group so a long
             # changes list stays well under Google Chat's 100-widget limit (one widget per
             # change used to push the reconciliation and stock-level sections off the card).
             max_changes = 50  # Show up to 50 changes total
-            changes_shown = 0
-
-            # Order: WC, Gizzard, Wings, Laps, Breast, Fillet, Bones, new parts, Others
-            product_order = ['WC', 'Gizzard', 'Wings', 'Laps', 'Breast', 'Fillet', 'Bones',
-                             'Cut 4', 'Head & Leg', 'Neck', 'Liver', 'Head', 'Leg']
 
             # Known groups first (in order), then any groups not in the predefined order
-            ordered_groups = [g for g in product_order if g in grouped_changes]
-            ordered_groups += [g for g in grouped_changes if g not in product_order]
+            ordered_groups = [g for g in PRODUCT_GROUP_ORDER if g in grouped_changes]
+            ordered_groups += [g for g in grouped_changes if g not in KNOWN_PRODUCT_GROUPS]
 
-            for product_group in ordered_groups:
-                if changes_shown >= max_changes:
-                    break
+            # Flatten in display order and truncate once, so every group left has lines to show
+            shown_changes = [(g, change) for g in ordered_groups for change in grouped_changes[g]][:max_changes]
 
+            for product_group, group_items in groupby(shown_changes, key=lambda item: item[0]):
                 group_lines = [f"<b>{product_group} Changes:</b>"]
-                for change in grouped_changes[product_group]:
-                    if changes_shown >= max_changes:
-                        break
-                    group_lines.append(format_change_description(change, include_product=False))
-                    changes_shown += 1
-
-                # Only emit a widget if the group actually contributed change lines
-                if len(group_lines) > 1:
-                    change_widgets.append({
-                        "textParagraph": {
-                            "text": "\n".join(group_lines)
-                        }
-                    })
+                group_lines.extend(format_change_description(change, include_product=False)
+                                   for _group, change in group_items)
+                change_widgets.append(text_paragraph("\n".join(group_lines)))
 
             if len(balance_changes) > max_changes:
                 more_count = len(balance_changes) - max_changes
-                more_suffix = "change" if more_count == 1 else "changes"
-                change_widgets.append({
-                    "decoratedText": {
-                        "text": f"<i>...and {more_count} more {more_suffix}</i>"
-                    }
-                })
+                change_widgets.append(decorated_text(
+                    f"<i>...and {more_count} more {plural_suffix(more_count, 'change', 'changes')}</i>"))
 
         # Difference changes
         difference_changes = []
@@ -1413,29 +1603,19 @@ def build_card_alert(balance_changes, balance_data, inventory_balance, gizzard_i
 
         if difference_changes:
             change_widgets.append({"divider": {}})
-            change_widgets.append({
-                "decoratedText": {
-                    "text": "<b>Inventory Balance Diff Changes:</b>"
-                }
-            })
+            change_widgets.append(decorated_text("<b>Inventory Balance Diff Changes:</b>"))
 
             for change_type, old_val, new_val in difference_changes:
                 if 'Chicken' in change_type:
-                    old_suffix = "pc" if abs(old_val) == 1 else "pcs"
-                    new_suffix = "pc" if abs(new_val) == 1 else "pcs"
                     # Abbreviate: WC Balance Diff instead of Whole Chicken Balance Difference
-                    change_text = f"WC Balance Diff: {old_val:,}{old_suffix}→{new_val:,}{new_suffix}"
+                    change_text = (f"WC Balance Diff: {old_val:,}{plural_suffix(old_val, 'pc', 'pcs')}"
+                                   f"→{new_val:,}{plural_suffix(new_val, 'pc', 'pcs')}")
                 else:
                     # Weight diffs (gizzard, neck, liver, head, leg): "<Part> Weight Diff: ...kg"
                     short = change_type.replace(' Balance Difference', ' Diff')
                     change_text = f"{short}: {old_val:,.2f}kg→{new_val:,.2f}kg"
 
-                change_widgets.append({
-                    "decoratedText": {
-                        "text": change_text,
-                        "startIcon": {"knownIcon": "STAR"}
-                    }
-                })
+                change_widgets.append(decorated_text(change_text, icon="STAR"))
 
         sections.append({
             "header": "⚠️ Changes Detected",
@@ -1445,7 +1625,9 @@ def build_card_alert(balance_changes, balance_data, inventory_balance, gizzard_i
     # (WC and Gizzard comparisons are now folded into the "Stock vs Inventory" section above)
 
     # Section 4: Whole Chicken Details
-    chicken_widgets = build_whole_chicken_widgets(balance_data)
+    # Both stock-level sections read the same product/grade pivot
+    balance_pivot = pivot_balance_columns(parsed_columns)
+    chicken_widgets = build_whole_chicken_widgets(balance_data, parsed_columns, balance_pivot)
     if chicken_widgets:
         sections.append({
             "header": "📦 WC Stock Levels",
@@ -1453,7 +1635,7 @@ def build_card_alert(balance_changes, balance_data, inventory_balance, gizzard_i
         })
 
     # Section 5: Gizzard & Parts Details
-    parts_widgets = build_gizzard_and_parts_widgets(balance_data)
+    parts_widgets = build_gizzard_and_parts_widgets(balance_data, parsed_columns, balance_pivot)
     if parts_widgets:
         sections.append({
             "header": "📦 Parts Stock Levels",
@@ -1483,19 +1665,13 @@ def build_card_alert(balance_changes, balance_data, inventory_balance, gizzard_i
         })
 
     # Build the complete card with severity-based header color
+    # Add severity indicator to subtitle
+    severity_prefix = SEVERITY_SUBTITLE_PREFIXES.get(severity)
     header_config = {
         "title": "🔔 Kaduna Inventory Alert",
-        "subtitle": f"Updated: {timestamp}"
+        "subtitle": f"{severity_prefix} | {timestamp}" if severity_prefix else f"Updated: {timestamp}"
     }
 
-    # Add severity indicator to subtitle
-    if severity == "HIGH":
-        header_config["subtitle"] = f"🔴 HIGH PRIORITY | {timestamp}"
-    elif severity == "MEDIUM":
-        header_config["subtitle"] = f"🟡 MEDIUM PRIORITY | {timestamp}"
-    else:
-        header_config["subtitle"] = f"Updated: {timestamp}"
-
     card = {
         "cardsV2": [{
             "cardId": "kaduna-inventory-alert",
@@ -1508,28 +1684,39 @@ def build_card_alert(balance_changes, balance_data, inventory_balance, gizzard_i
 
     return card
 
-def build_whole_chicken_widgets(balance_data):
-    """Build widgets for whole chicken details section."""
+# Display order of the stock-level sections. WC weight ranges not listed here are not shown.
+WC_WEIGHT_ORDER = ('BELOW 1KG', '1KG', '1.1KG', '1.2KG', '1.3KG', '1.4KG', '1.5KG', '1.6KG',
+                   '1.7KG', '1.8KG', '1.9KG', '2KG ABOVE', 'UNCATEGORISED')
+PARTS_DISPLAY_ORDER = ('GIZZARD', 'WINGS', 'LAPS', 'BREAST', 'FILLET', 'BONES',
+                       'CUT 4', 'HEAD & LEG', 'NECK', 'LIVER', 'HEAD', 'LEG')
+# Parts grades, A before B before C before D; unlisted grades follow alphabetically
+PARTS_GRADE_ORDER = ('Grade A (Standard Gizzard)', 'Grade A (Standard Wings)', 'Grade A (Standard Laps)',
+                     'Grade A (Standard Breast)', 'Grade A (Standard Fillet)', 'Grade A (Standard Bones)',
+                     'Grade A', 'Grade B', 'Grade C', 'Grade D')
+PARTS_GRADE_POSITION = {grade: position for position, grade in enumerate(PARTS_GRADE_ORDER)}
+
+def build_whole_chicken_widgets(balance_data, parsed_columns=None, pivot=None):
+    """Build widgets for whole chicken details section.
+    pivot is an optional pivot_balance_columns() result to reuse.
+    """
     widgets = []
-    parsed_columns = parse_balance_data(balance_data)
+    if pivot is None:
+        if parsed_columns is None:
+            parsed_columns = parse_balance_data(balance_data)
+        pivot = pivot_balance_columns(parsed_columns)
 
-    # Group whole chicken data by weight range
+    # Group whole chicken grades by weight range
     weight_ranges = {}
-    for col in parsed_columns:
-        if 'WHOLE CHICKEN' in col['product']:
-            weight = col['product'].replace('WHOLE CHICKEN - ', '')
-            if weight not in weight_ranges:
-                weight_ranges[weight] = []
-            weight_ranges[weight].append(col)
-
-    # Sort weight ranges
-    weight_order = ['BELOW 1KG', '1KG', '1.1KG', '1.2KG', '1.3KG', '1.4KG', '1.5KG', '1.6KG', '1.7KG', '1.8KG', '1.9KG', '2KG ABOVE', 'UNCATEGORISED']
+    for product, product_grades in pivot.items():
+        weight = whole_chicken_weight_range(product)
+        if weight is not None:
+            weight_ranges[weight] = product_grades
 
     total_qty = 0
     total_weight_kg = 0
 
     # Filter to only weights with data
-    weights_with_data = [w for w in weight_order if w in weight_ranges]
+    weights_with_data = [w for w in WC_WEIGHT_ORDER if w in weight_ranges]
 
     for idx, weight in enumerate(weights_with_data):
         # Get weight per piece for this category (used to calculate weight from qty)
@@ -1537,13 +1724,7 @@ def build_whole_chicken_widgets(balance_data):
 
         # Group by grade
         grades = {'Grade A (Standard Bird)': {}, 'Grade B': {}, 'Grade C': {}, 'Grade D': {}}
-        for col in weight_ranges[weight]:
-            grade = col['grade']
-            metric = col['metric']
-            value = col['value']
-            if grade not in grades:
-                grades[grade] = {}
-            grades[grade][metric] = value
+        grades.update(weight_ranges[weight])
 
         # Build combined text for this weight category
         grade_lines = [f"<b>{weight}</b>"]
@@ -1554,35 +1735,27 @@ def build_whole_chicken_widgets(balance_data):
             if not grade_data:
                 continue
 
-            grade_display = grade_name.replace('(Standard Bird)', '').strip()
-            qty = float(grade_data.get('Qty', 0))
+            grade_display = grade_display_name(grade_name)
+            qty = grade_data.get('Qty') or 0.0
             weight_kg = qty * weight_per_piece  # Calculate weight: qty × weight per piece
 
             total_qty += qty
             total_weight_kg += weight_kg
 
             # Format qty as bags + pieces (compact format)
-            bags = int(qty // 20)
-            remaining = int(qty % 20)
-            bags_suffix = "bag" if bags == 1 else "bags"
-            pcs_suffix = "pc" if remaining == 1 else "pcs"
-
-            if bags > 0 and remaining > 0:
-                qty_display = f"{bags}{bags_suffix}+{remaining}{pcs_suffix}"
-            elif bags > 0:
-                qty_display = f"{bags}{bags_suffix}"
-            else:
-                qty_display = f"{remaining}{pcs_suffix}"
+            bags, remaining = map(int, divmod(qty, 20))
+            qty_parts = []
+            if bags > 0:
+                qty_parts.append(f"{bags}{plural_suffix(bags, 'bag', 'bags')}")
+            if remaining > 0 or bags <= 0:
+                qty_parts.append(f"{remaining}{plural_suffix(remaining, 'pc', 'pcs')}")
+            qty_display = "+".join(qty_parts)
 
             grade_lines.append(f"{grade_display}: {qty_display} ({weight_kg:,.1f}kg)")
 
         # Combine all lines into single widget using textParagraph for proper multi-line rendering
         combined_text = "\n".join(grade_lines)
-        widgets.append({
-            "textParagraph": {
-                "text": combined_text
-            }
-        })
+        widgets.append(text_paragraph(combined_text))
 
         # Add divider after each weight category for better readability
         widgets.append({"divider": {}})
@@ -1590,69 +1763,35 @@ def build_whole_chicken_widgets(balance_data):
     # Add totals
     total_tonnes = total_weight_kg / 1000
     widgets.append({"divider": {}})
-    widgets.append({
-        "decoratedText": {
-            "text": f"<b>TOTAL: {int(total_qty):,} pcs (≈ {total_weight_kg:,.1f} kg / {total_tonnes:.1f} t)</b>"
-        }
-    })
+    widgets.append(decorated_text(f"<b>TOTAL: {int(total_qty):,} pcs (≈ {total_weight_kg:,.1f} kg / {total_tonnes:.1f} t)</b>"))
 
     return widgets
 
-def build_gizzard_and_parts_widgets(balance_data):
-    """Build widgets for gizzard and parts details section."""
+def build_gizzard_and_parts_widgets(balance_data, parsed_columns=None, pivot=None):
+    """Build widgets for gizzard and parts details section.
+    pivot is an optional pivot_balance_columns() result to reuse.
+    """
     widgets = []
-    parsed_columns = parse_balance_data(balance_data)
-
-    # Products to display (in order)
-    products_order = ['GIZZARD', 'WINGS', 'LAPS', 'BREAST', 'FILLET', 'BONES',
-                      'CUT 4', 'HEAD & LEG', 'NECK', 'LIVER', 'HEAD', 'LEG']
-
-    # First pass: identify which products have data
-    products_with_data = []
-    for product_name in products_order:
-        product_cols = [col for col in parsed_columns if col['product'] == product_name]
-        if product_cols:
-            # Check if product has any data (packs > 0 or weight > 0)
-            has_any_data = False
-            for col in product_cols:
-                if col['metric'] == 'Packs':
-                    try:
-                        if float(col['value']) > 0:
-                            has_any_data = True
-                            break
-                    except (ValueError, TypeError):
-                        pass
-                elif col['metric'] == 'Weight(kg)':
-                    try:
-                        if float(col['value']) > 0:
-                            has_any_data = True
-                            break
-                    except (ValueError, TypeError):
-                        pass
-            if has_any_data:
-                products_with_data.append(product_name)
+    if pivot is None:
+        if parsed_columns is None:
+            parsed_columns = parse_balance_data(balance_data)
+        pivot = pivot_balance_columns(parsed_columns)
+
+    # First pass: identify which products have data (packs > 0 or weight > 0)
+    products_with_data = [
+        product_name for product_name in PARTS_DISPLAY_ORDER
+        if any((grade_data.get('Packs') or 0) > 0 or (grade_data.get('Weight(kg)') or 0) > 0
+               for grade_data in pivot.get(product_name, {}).values())
+    ]
 
     # Second pass: display products with data and add dividers
     for prod_idx, product_name in enumerate(products_with_data):
-        # Get data for this product
-        product_cols = [col for col in parsed_columns if col['product'] == product_name]
-
-        # Group by grade dynamically from actual data
-        grades = {}
-        for col in product_cols:
-            grade = col['grade']
-            metric = col['metric']
-            value = col['value']
-            if grade not in grades:
-                grades[grade] = {}
-            grades[grade][metric] = value
+        # Grades for this product, taken dynamically from actual data
+        grades = pivot[product_name]
 
         # Sort grades for consistent display (A before B before C before D)
-        grade_order = [g for g in ['Grade A (Standard Gizzard)', 'Grade A (Standard Wings)', 'Grade A (Standard Laps)',
-                                   'Grade A (Standard Breast)', 'Grade A (Standard Fillet)', 'Grade A (Standard Bones)',
-                                   'Grade A', 'Grade B', 'Grade C', 'Grade D'] if g in grades]
-        # Add any remaining grades not in the predefined order
-        grade_order.extend([g for g in sorted(grades.keys()) if g not in grade_order])
+        # Grades not in the predefined order sort after it, alphabetically
+        grade_order = sorted(grades, key=lambda g: (PARTS_GRADE_POSITION.get(g, len(PARTS_GRADE_ORDER)), g))
 
         # Build combined text for this product
         product_lines = [f"<b>{product_name.title()}</b>"]
@@ -1663,10 +1802,10 @@ def build_gizzard_and_parts_widgets(balance_data):
             if not grade_data:
                 continue
 
-            grade_display = re.sub(r'\s*\(Standard [^)]*\)', '', grade_name).strip()
+            grade_display = grade_display_name(grade_name)
 
-            packs = float(grade_data.get('Packs', 0)) if grade_data.get('Packs') else 0
-            weight = float(grade_data.get('Weight(kg)', 0)) if grade_data.get('Weight(kg)') else 0
+            packs = grade_data.get('Packs') or 0
+            weight = grade_data.get('Weight(kg)') or 0
 
             # Only show grades with actual data
             if packs > 0 or weight > 0:
@@ -1674,19 +1813,17 @@ def build_gizzard_and_parts_widgets(balance_data):
 
         # Combine all lines into single widget using textParagraph for proper multi-line rendering
         combined_text = "\n".join(product_lines)
-        widgets.append({
-            "textParagraph": {
-                "text": combined_text
-            }
-        })
+        widgets.append(text_paragraph(combined_text))
 
         # Add divider after each product for better readability
         widgets.append({"divider": {}})
 
     return widgets
 
-def send_combined_alert(webhook_url, balance_changes, balance_data, inventory_balance=None, gizzard_inventory_packs=None, gizzard_inventory_weight=None, chicken_difference_changes=None, gizzard_difference_changes=None, parts_inventory_weights=None, parts_difference_changes=None):
+def send_combined_alert(webhook_url, balance_changes, balance_data, inventory_balance=None, gizzard_inventory_packs=None, gizzard_inventory_weight=None, chicken_difference_changes=None, gizzard_difference_changes=None, parts_inventory_weights=None, parts_difference_changes=None, parsed_columns=None, balance_totals=None):
     """Send combined alert to Google Space as a single card message."""
+    import pybreaker
+
     try:
         # Only proceed if there are actual changes
         if not balance_changes and not chicken_difference_changes and not gizzard_difference_changes and not parts_difference_changes:
@@ -1694,17 +1831,19 @@ def send_combined_alert(webhook_url, balance_changes, balance_data, inventory_ba
             return True
 
         print("Preparing to send card alert message...")
+        import requests
 
         # Build the card
         card = build_card_alert(
             balance_changes, balance_data, inventory_balance,
             gizzard_inventory_packs, gizzard_inventory_weight,
             chicken_difference_changes, gizzard_difference_changes,
-            parts_inventory_weights, parts_difference_changes
+            parts_inventory_weights, parts_difference_changes,
+            parsed_columns, balance_totals
         )
 
         # Send card message
-        @webhook_circuit_breaker
+        @get_webhook_circuit_breaker()
         @retry(
             retry=retry_if_exception(should_retry_webhook),
             stop=stop_after_attempt(5),
@@ -1713,7 +1852,7 @@ def send_combined_alert(webhook_url, balance_changes, balance_data, inventory_ba
         )
         def _send_webhook(payload):
             print(f"Sending card webhook request...")
-            response = requests.post(webhook_url, json=payload, timeout=10)
+            response = get_webhook_session().post(webhook_url, json=payload, timeout=10)
             if not response.ok:
                 response_text = response.text.strip()
                 if response_text:
@@ -1765,40 +1904,38 @@ def main():
         check_failed_webhooks()
 
         # Clear any previous state read failure alert file first
-        if os.path.exists(STATE_READ_FAILURE_ALERT_FILE):
+        try:
             os.remove(STATE_READ_FAILURE_ALERT_FILE)
+        except FileNotFoundError:
+            pass
 
         print("✅ Using encrypted state files for reliable change detection")
 
         # Initialize the Sheets API service
         print("Initializing Google Sheets service...")
-        service = get_service()
-        
-        # Get current balance data (includes stock and parts in one sheet)
-        balance_data = get_sheet_data(service, STOCK_SHEET_NAME, STOCK_RANGE)
-
-        # Fetch the inventory summary sheet once and share it across the parsers below
-        def _fetch_summary_data():
-            result = service.spreadsheets().values().get(
-                spreadsheetId=INVENTORY_SHEET_ID,
-                range=f'{INVENTORY_SHEET_NAME}!{INVENTORY_RANGE}'
-            ).execute()
-            return result.get('values', [])
+        credentials = get_credentials()
+        service = get_service(credentials)
+
+        # The Balance and inventory summary sheets live in different spreadsheets, so
+        # fetch them concurrently; the summary request gets its own authorized transport
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            summary_future = executor.submit(
+                get_inventory_summary_data, service, AuthorizedHttp(credentials, http=build_http())
+            )
+            balance_data = get_sheet_data(service, STOCK_SHEET_NAME, STOCK_RANGE)
+            summary_data = summary_future.result()
 
-        try:
-            summary_data = robust_api_call(_fetch_summary_data)
-        except Exception as e:
-            print(f"Error fetching inventory summary data: {str(e)}")
-            summary_data = None
+        # Index the summary header row once for all three inventory lookups
+        summary_header = summary_header_index(summary_data[0]) if summary_data else None
 
         # Get inventory balance for comparison
-        inventory_balance = get_inventory_balance(summary_data)
+        inventory_balance = get_inventory_balance(summary_data, summary_header)
 
         # Get gizzard inventory balance for comparison (returns tuple: packs, weight)
-        gizzard_inventory_packs, gizzard_inventory_weight = get_gizzard_inventory_balance(summary_data)
+        gizzard_inventory_packs, gizzard_inventory_weight = get_gizzard_inventory_balance(summary_data, summary_header)
 
         # Get weight inventory balances for the reconciled parts (see WEIGHT_RECON_PARTS)
-        parts_inventory_weights = get_parts_inventory_weights(summary_data)
+        parts_inventory_weights = get_parts_inventory_weights(summary_data, summary_header)
 
         # Load previous states
         previous_balance_data = load_previous_state(BALANCE_STATE_FILE)
@@ -1807,13 +1944,18 @@ def main():
         previous_gizzard_weight_diff = load_previous_state(GIZZARD_WEIGHT_DIFF_STATE_FILE)
         previous_parts_diff = load_previous_state(PARTS_WEIGHT_DIFF_STATE_FILE)
 
+        # Parse the balance sheet once; the differences and the alert card all reuse it
+        parsed_columns = parse_balance_data(balance_data)
+        balance_totals = summarize_balance_totals(parsed_columns)
+
         # Calculate current differences (returns: chicken_diff, gizzard_packs_diff, gizzard_weight_diff)
         current_chicken_diff, current_gizzard_packs_diff, current_gizzard_weight_diff = calculate_current_differences(
-            balance_data, inventory_balance, gizzard_inventory_packs, gizzard_inventory_weight
+            balance_data, inventory_balance, gizzard_inventory_packs, gizzard_inventory_weight,
+            parsed_columns, balance_totals
         )
 
         # Calculate current per-part weight differences (dict: {product_name: spec - inventory})
-        current_parts_diff = calculate_parts_weight_differences(balance_data, parts_inventory_weights)
+        current_parts_diff = calculate_parts_weight_differences(balance_data, parts_inventory_weights, parsed_columns)
 
         # Check for changes in balance data
         balance_changes = []
@@ -1858,14 +2000,15 @@ def main():
             if send_combined_alert(webhook_url, balance_changes, balance_data, inventory_balance,
                                  gizzard_inventory_packs, gizzard_inventory_weight,
                                  chicken_difference_changes, gizzard_difference_changes,
-                                 parts_inventory_weights, parts_difference_changes):
+                                 parts_inventory_weights, parts_difference_changes,
+                                 parsed_columns, balance_totals):
                 print("Alert sent successfully, updating state files...")
             else:
                 print("Failed to send alert, but will still update state files...")
         else:
             print("No changes detected, updating state files...")
 
-        # Always update all state files at the end
+        # Update all state files at the end (unchanged states are left untouched)
         save_current_state(balance_data, BALANCE_STATE_FILE)
         save_current_state(current_chicken_diff, WHOLE_CHICKEN_DIFF_STATE_FILE)
         save_current_state(current_gizzard_packs_diff, GIZZARD_PACKS_DIFF_STATE_FILE)
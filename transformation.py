@@ -1,14 +1,17 @@
+import numpy as np
 import pandas as pd
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-import gspread
 import os
-import time
-import random
 from typing import Tuple, Dict, List, Any
+from collections import defaultdict
 from datetime import datetime
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from http.client import HTTPException
+import socket
+import httplib2
+from google.auth.exceptions import TransportError
+from tenacity import retry, stop_after_attempt, wait_exponential, wait_random, retry_if_exception
 
 SHEET_NAMES = {
     'STOCK_INFLOW': 'stock_inflow',
@@ -19,7 +22,11 @@ SHEET_NAMES = {
 }
 
 DATE_FORMATS = ['%d %b %Y', '%d/%m/%y', '%d-%b-%Y']
+MONTH_ABBREVIATIONS = np.array(['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'], dtype=object)
+MONTH_ABBREVIATIONS_LOWER = np.array([month.lower() for month in MONTH_ABBREVIATIONS], dtype=object)
 GOOGLE_SHEETS_SCOPE = ['https://www.googleapis.com/auth/spreadsheets']
+# Day zero of Google Sheets date serial numbers
+SHEETS_EPOCH = pd.Timestamp('1899-12-30')
 
 class DataProcessingError(Exception):
     """Custom exception for data processing errors"""
@@ -28,27 +35,30 @@ class DataProcessingError(Exception):
 def is_rate_limit_error(exception):
     """Check if the exception is a rate limit error"""
     if isinstance(exception, HttpError):
-        return exception.resp.status in [429, 500, 502, 503]
+        return exception.resp.status in [429, 500, 502, 503, 504]
     if isinstance(exception, Exception):
         error_str = str(exception).lower()
         return any(term in error_str for term in ['quota', 'rate limit', 'too many requests', '429'])
     return False
 
+TRANSIENT_NETWORK_ERRORS = (ConnectionError, TimeoutError, socket.timeout, HTTPException,
+                            httplib2.HttpLib2Error, TransportError)
+
+def is_transient_api_error(exception):
+    """Retry Sheets rate limits and 5xx responses, plus network failures."""
+    if isinstance(exception, TRANSIENT_NETWORK_ERRORS):
+        return True
+    return is_rate_limit_error(exception)
+
 @retry(
-    retry=retry_if_exception_type((HttpError, Exception)),
+    retry=retry_if_exception(is_transient_api_error),
     stop=stop_after_attempt(5),
-    wait=wait_exponential(multiplier=1, min=1, max=30),
-    before_sleep=lambda retry_state: print(f"Rate limit hit, retrying in {retry_state.next_action.sleep} seconds... (attempt {retry_state.attempt_number})")
+    wait=wait_exponential(multiplier=1, min=1, max=10) + wait_random(0.5, 2.0),
+    before_sleep=lambda retry_state: print(f"Transient API error, retrying in {retry_state.next_action.sleep:.1f} seconds... (attempt {retry_state.attempt_number})")
 )
 def robust_sheets_operation(operation_func, *args, **kwargs):
     """Execute sheets operation with robust retry logic"""
-    try:
-        return operation_func(*args, **kwargs)
-    except Exception as e:
-        if is_rate_limit_error(e):
-            # Add jitter to prevent thundering herd
-            time.sleep(random.uniform(0.5, 2.0))
-        raise
+    return operation_func(*args, **kwargs)
 
 def get_credentials(credentials_file: str) -> service_account.Credentials:
     """Create and return credentials for Google Sheets access"""
@@ -60,47 +70,54 @@ def get_credentials(credentials_file: str) -> service_account.Credentials:
     except Exception as e:
         raise DataProcessingError(f"Failed to create credentials: {str(e)}")
 
-def connect_to_sheets(credentials: service_account.Credentials, spreadsheet_id: str) -> gspread.Spreadsheet:
-    max_retries = 3
+def values_to_df(values: List[List[Any]], worksheet_name: str) -> pd.DataFrame:
+    """Build a DataFrame from raw sheet values, padding short rows the way gspread's get_all_values does"""
+    if not values:
+        raise DataProcessingError(f"No data found in worksheet {worksheet_name}")
 
-    for attempt in range(max_retries):
-        try:
-            # Use the newer approach to avoid deprecation warning
-            gc = gspread.Client(auth=credentials)
-            return gc.open_by_key(spreadsheet_id)
-        except Exception as e:
-            if attempt < max_retries - 1 and "500" in str(e):
-                print(f"Attempt {attempt + 1} failed with 500 error, retrying in {2 ** attempt} seconds...")
-                time.sleep(2 ** attempt)
-                continue
-            raise DataProcessingError(f"Failed to connect to Google Sheets after {attempt + 1} attempts: {str(e)}")
+    # The Sheets API drops trailing empty cells from each row
+    width = max(len(row) for row in values)
+    padded = [row + [''] * (width - len(row)) for row in values]
 
-def read_worksheet_to_df(spreadsheet: gspread.Spreadsheet, worksheet_name: str) -> pd.DataFrame:
+    df = pd.DataFrame(padded[1:], columns=padded[0])
+
+    if 'date' in df.columns:
+        print(f"\nProcessing dates in {worksheet_name}")
+
+    return df
+
+def read_worksheets_to_dfs(service: Any, spreadsheet_id: str, worksheet_names: List[str]) -> Dict[str, pd.DataFrame]:
+    """Read several worksheets in a single values.batchGet round trip"""
     try:
-        def _get_worksheet_data():
-            worksheet = spreadsheet.worksheet(worksheet_name)
-            return worksheet.get_all_values()
-        
-        all_values = robust_sheets_operation(_get_worksheet_data)
-        if not all_values:
-            raise DataProcessingError(f"No data found in worksheet {worksheet_name}")
-        
-        headers = all_values[0]
-        data = all_values[1:]
-        df = pd.DataFrame(data, columns=headers)
-        
-        if 'date' in df.columns:
-            print(f"\nProcessing dates in {worksheet_name}")
-        
-        return df
+        def _batch_get():
+            return service.spreadsheets().values().batchGet(
+                spreadsheetId=spreadsheet_id,
+                ranges=worksheet_names,
+                valueRenderOption='UNFORMATTED_VALUE',
+                dateTimeRenderOption='SERIAL_NUMBER',
+                fields='valueRanges(values)'
+            ).execute()
+
+        value_ranges = robust_sheets_operation(_batch_get).get('valueRanges', [])
     except Exception as e:
-        raise DataProcessingError(f"Failed to read worksheet {worksheet_name}: {str(e)}")
+        raise DataProcessingError(f"Failed to read worksheets {', '.join(worksheet_names)}: {str(e)}")
+
+    dataframes = {}
+    for index, worksheet_name in enumerate(worksheet_names):
+        values = value_ranges[index].get('values', []) if index < len(value_ranges) else []
+        try:
+            dataframes[worksheet_name] = values_to_df(values, worksheet_name)
+        except DataProcessingError:
+            raise
+        except Exception as e:
+            raise DataProcessingError(f"Failed to read worksheet {worksheet_name}: {str(e)}")
+    return dataframes
 
 def standardize_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     try:
         print("\nStandardizing dataframe...")
         
-        df_clean = df.copy()
+        df_clean = df.copy(deep=False)
         
         # Standardize column names
         df_clean.columns = (df_clean.columns.str.lower()
@@ -115,7 +132,7 @@ def standardize_dataframe(df: pd.DataFrame) -> pd.DataFrame:
         for column in df_clean.columns:
             df_clean[column] = df_clean[column].astype(str).str.strip().str.lower()
             try:
-                cleaned = df_clean[column].str.replace(',', '').str.replace(r'\s+', '', regex=True)
+                cleaned = df_clean[column].str.replace(',', '', regex=False).str.replace(r'\s+', '', regex=True)
                 numeric_values = pd.to_numeric(cleaned)
                 df_clean[column] = numeric_values
             except (ValueError, TypeError):
@@ -125,10 +142,45 @@ def standardize_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     except Exception as e:
         raise DataProcessingError(f"Failed to standardize dataframe: {str(e)}")
 
+def candidate_date_formats(dates: pd.Series) -> List[str]:
+    """Return the DATE_FORMATS that match a sample value, so the likely format is tried first"""
+    sample = dates.dropna()
+    if sample.empty:
+        return DATE_FORMATS
+
+    sample_value = str(sample.iat[0]).strip()
+    matching = []
+    for format in DATE_FORMATS:
+        try:
+            datetime.strptime(sample_value, format)
+            matching.append(format)
+        except ValueError:
+            continue
+    return matching
+
+def parse_date_strings(dates: pd.Series) -> pd.Series:
+    """Parse text dates format by format, each pass only touching rows no earlier format matched"""
+    candidates = candidate_date_formats(dates)
+    formats = candidates + [format for format in DATE_FORMATS if format not in candidates]
+
+    parsed = pd.Series(pd.NaT, index=dates.index, dtype='datetime64[ns]')
+    for format in formats:
+        unparsed = parsed.isna() & dates.notna()
+        if not unparsed.any():
+            break
+        print(f"Trying date format: {format}")
+        parsed[unparsed] = pd.to_datetime(dates[unparsed], format=format, errors='coerce')
+
+    unparsed = parsed.isna() & dates.notna()
+    if unparsed.any():
+        print(f"Falling back to mixed format parsing for {unparsed.sum()} dates")
+        parsed[unparsed] = pd.to_datetime(dates[unparsed], format='mixed', dayfirst=True)
+    return parsed
+
 def standardize_dates(df: pd.DataFrame) -> pd.DataFrame:
     if df.empty:
         # Add required columns even for empty dataframe to avoid KeyError downstream
-        df = df.copy()
+        df = df.copy(deep=False)
         df['month'] = pd.Series(dtype='str')
         df['year_month'] = pd.Series(dtype='str')
         print("Empty dataframe - added month and year_month columns")
@@ -136,31 +188,30 @@ def standardize_dates(df: pd.DataFrame) -> pd.DataFrame:
 
     try:
         print("\nStandardizing dates...")
-        df = df.copy()
-        
-        date_parsed = False
-        for format in DATE_FORMATS:
-            try:
-                print(f"Trying date format: {format}")
-                df['date'] = pd.to_datetime(df['date'], format=format)
-                date_parsed = True
-                print("Successfully parsed dates using format:", format)
-                break
-            except ValueError as e:
-                print(f"Failed to parse with format {format}: {str(e)}")
-                continue
-        
-        if not date_parsed:
-            print("Falling back to mixed format parsing")
-            df['date'] = pd.to_datetime(df['date'], format='mixed', dayfirst=True)
+        df = df.copy(deep=False)
+        
+        # Real date cells arrive as Sheets serial day numbers; only text dates need string parsing
+        serial_days = pd.to_numeric(df['date'], errors='coerce')
+        is_serial = serial_days.notna()
+        if is_serial.all():
+            print("Converting spreadsheet serial dates")
+            df['date'] = SHEETS_EPOCH + pd.to_timedelta(serial_days, unit='D')
+        elif is_serial.any():
+            print(f"Converting {is_serial.sum()} spreadsheet serial dates")
+            dates = SHEETS_EPOCH + pd.to_timedelta(serial_days, unit='D')
+            dates[~is_serial] = parse_date_strings(df.loc[~is_serial, 'date'])
+            df['date'] = dates
+        else:
+            df['date'] = parse_date_strings(df['date'])
         
         if df['date'].isna().any():
             problematic_dates = df[df['date'].isna()]['date'].unique()
             print(f"Warning: Failed to parse {len(problematic_dates)} date entries")
             raise DataProcessingError(f"Failed to parse {len(problematic_dates)} date entries")
         
-        df['month'] = df['date'].dt.strftime('%b').str.lower()
-        df['year_month'] = df['date'].dt.strftime('%Y-%b')
+        month_index = df['date'].dt.month.to_numpy() - 1
+        df['month'] = MONTH_ABBREVIATIONS_LOWER[month_index]
+        df['year_month'] = df['date'].dt.year.astype(str) + '-' + MONTH_ABBREVIATIONS[month_index]
         
         return df
     except Exception as e:
@@ -169,7 +220,7 @@ def standardize_dates(df: pd.DataFrame) -> pd.DataFrame:
 def remove_opening_stock(df: pd.DataFrame, column_name: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
     try:
         print(f"\nRemoving opening stock using column: {column_name}")
-        opening_stock_mask = df[column_name].str.contains('opening stock', case=False, na=False)
+        opening_stock_mask = df[column_name].str.lower().str.contains('opening stock', regex=False, na=False)
         opening_stock_df = df[opening_stock_mask].copy()
         main_df = df[~opening_stock_mask].copy()
         
@@ -179,6 +230,24 @@ def remove_opening_stock(df: pd.DataFrame, column_name: str) -> Tuple[pd.DataFra
     except Exception as e:
         raise DataProcessingError(f"Failed to separate opening stock: {str(e)}")
 
+def aggregate_by_product(df: pd.DataFrame, product_column: str) -> Dict[Any, pd.DataFrame]:
+    """Sum weight (and quantity, where a product has any) per year_month for every product in a single groupby"""
+    metrics = ['weight']
+    if 'quantity' in df.columns:
+        metrics.append('quantity')
+
+    totals = df.groupby([product_column, 'year_month'])[metrics].sum()
+    if 'quantity' in df.columns:
+        has_quantity = df['quantity'].notna().groupby(df[product_column]).any()
+    else:
+        has_quantity = pd.Series(dtype=bool)
+
+    product_summaries = {}
+    for product_type in totals.index.get_level_values(0).unique():
+        product_metrics = ['weight', 'quantity'] if has_quantity.get(product_type, False) else ['weight']
+        product_summaries[product_type] = totals.xs(product_type, level=0)[product_metrics]
+    return product_summaries
+
 def create_summary_df(stock_inflow_df: pd.DataFrame, release_df: pd.DataFrame) -> pd.DataFrame:
     try:
         # Handle empty dataframes - return empty summary with expected columns
@@ -186,8 +255,8 @@ def create_summary_df(stock_inflow_df: pd.DataFrame, release_df: pd.DataFrame) -
             print("Both inflow and release dataframes are empty - returning empty summary")
             return pd.DataFrame(columns=['month', 'year_month'])
 
-        all_year_months = sorted(list(set(stock_inflow_df['year_month'].unique()) |
-                                    set(release_df['year_month'].unique())))
+        all_year_months = list(set(stock_inflow_df['year_month'].unique()) |
+                               set(release_df['year_month'].unique()))
 
         # Filter out any NaN or empty values that might have slipped through
         all_year_months = [ym for ym in all_year_months if pd.notna(ym) and ym != '']
@@ -196,9 +265,16 @@ def create_summary_df(stock_inflow_df: pd.DataFrame, release_df: pd.DataFrame) -
             print("No valid year_month values found - returning empty summary")
             return pd.DataFrame(columns=['month', 'year_month'])
 
+        # Order months chronologically once; every later step relies on this order
+        month_starts = pd.to_datetime(pd.Series(all_year_months), format='%Y-%b').sort_values()
+        all_year_months = [all_year_months[i] for i in month_starts.index]
+        month_starts = month_starts.reset_index(drop=True)
+
         summary_df = pd.DataFrame({'year_month': all_year_months})
         summary_df['month'] = summary_df['year_month'].str.split('-').str[1].str.lower()
         summary_df = summary_df[['month', 'year_month']]
+        # Row order for aligning per-month aggregates onto the summary
+        summary_months = pd.Index(all_year_months)
         
         # Get unique product types dynamically from the data
         
@@ -214,27 +290,13 @@ def create_summary_df(stock_inflow_df: pd.DataFrame, release_df: pd.DataFrame) -
         else:
             release_products = []
         
-        # Process inflow data for each product type
-        for product_type in inflow_products:
-            product_data = stock_inflow_df[stock_inflow_df['product_type'] == product_type]
-            if not product_data.empty:
-                agg_dict = {'weight': 'sum'}
-                # Add quantity aggregation for products that have quantity data
-                if 'quantity' in product_data.columns and product_data['quantity'].notna().any():
-                    agg_dict['quantity'] = 'sum'
-                
-                product_summaries[f'{product_type}_inflow'] = product_data.groupby('year_month').agg(agg_dict)
+        # Aggregate inflow and release data for every product type in one groupby each
+        for product_type, product_summary in aggregate_by_product(stock_inflow_df, 'product_type').items():
+            product_summaries[f'{product_type}_inflow'] = product_summary
         
-        # Process release data for each product type
-        for product_type in release_products:
-            product_data = release_df[release_df['product'] == product_type]
-            if not product_data.empty:
-                agg_dict = {'weight': 'sum'}
-                # Add quantity aggregation for products that have quantity data
-                if 'quantity' in product_data.columns and product_data['quantity'].notna().any():
-                    agg_dict['quantity'] = 'sum'
-                
-                product_summaries[f'{product_type}_release'] = product_data.groupby('year_month').agg(agg_dict)
+        if len(release_products):
+            for product_type, product_summary in aggregate_by_product(release_df, 'product').items():
+                product_summaries[f'{product_type}_release'] = product_summary
         
         # Create dynamic summary columns for inflow and release
         summary_columns = {}
@@ -261,8 +323,8 @@ def create_summary_df(stock_inflow_df: pd.DataFrame, release_df: pd.DataFrame) -
         
         for col_name, (summary_key, metric) in summary_columns.items():
             if metric in product_summaries[summary_key].columns:
-                summary_df[col_name] = summary_df['year_month'].map(
-                    product_summaries[summary_key][metric]).fillna(0)
+                summary_df[col_name] = product_summaries[summary_key][metric].reindex(
+                    summary_months, fill_value=0).to_numpy()
             else:
                 summary_df[col_name] = 0
 
@@ -272,16 +334,26 @@ def create_summary_df(stock_inflow_df: pd.DataFrame, release_df: pd.DataFrame) -
         if 'customer_type' in release_df.columns:
             # Get unique customer types
             customer_types = release_df['customer_type'].dropna().unique()
+
+            # Scan the product column once per target product rather than once per customer type
+            release_products_lower = release_df['product'].str.lower()
+            product_masks = {
+                target_product: release_products_lower.str.contains(target_product, regex=False, na=False)
+                for target_product in target_products
+            }
+            
+            # Customer type columns per (product, metric), for the validation below (dict keys keep
+            # insertion order and drop the duplicates two customer types can clean to)
+            customer_columns = defaultdict(dict)
             
             for target_product in target_products:
-                # Check if this product exists in release data
-                product_exists = release_df['product'].str.contains(target_product, case=False, na=False).any()
+                product_mask = product_masks[target_product]
                 
-                if product_exists:
+                if product_mask.any():
                     for customer_type in customer_types:
                         # Filter data for specific product and customer type
                         filtered_data = release_df[
-                            (release_df['product'].str.contains(target_product, case=False, na=False)) &
+                            product_mask &
                             (release_df['customer_type'] == customer_type)
                         ]
                         
@@ -304,57 +376,32 @@ def create_summary_df(stock_inflow_df: pd.DataFrame, release_df: pd.DataFrame) -
                                 # Add columns to summary_df
                                 if 'quantity' in agg_dict:
                                     col_name = f'{clean_product}_release_{clean_customer_type}_quantity'
-                                    summary_df[col_name] = summary_df['year_month'].map(
-                                        customer_product_summary['quantity']).fillna(0)
+                                    summary_df[col_name] = customer_product_summary['quantity'].reindex(
+                                        summary_months, fill_value=0).to_numpy()
+                                    customer_columns[(target_product, 'quantity')][col_name] = None
                                 
                                 if 'weight' in agg_dict:
                                     col_name = f'{clean_product}_release_{clean_customer_type}_weight'
-                                    summary_df[col_name] = summary_df['year_month'].map(
-                                        customer_product_summary['weight']).fillna(0)
+                                    summary_df[col_name] = customer_product_summary['weight'].reindex(
+                                        summary_months, fill_value=0).to_numpy()
+                                    customer_columns[(target_product, 'weight')][col_name] = None
 
             # Validation: Ensure customer type columns sum to total columns
             for target_product in target_products:
                 clean_product = target_product.replace(' ', '_').lower()
                 
-                # Check quantity validation
-                total_qty_col = f'total_{clean_product}_release_quantity'
-                if total_qty_col in summary_df.columns:
-                    customer_qty_cols = [col for col in summary_df.columns 
-                                       if col.startswith(f'{clean_product}_release_') 
-                                       and col.endswith('_quantity')]
+                for metric in ('quantity', 'weight'):
+                    total_col = f'total_{clean_product}_release_{metric}'
+                    customer_cols = list(customer_columns[(target_product, metric)])
+                    if total_col not in summary_df.columns or not customer_cols:
+                        continue
                     
-                    if customer_qty_cols:
-                        customer_sum = summary_df[customer_qty_cols].sum(axis=1)
-                        total_values = summary_df[total_qty_col]
-                        
-                        # Allow for small floating point differences
-                        tolerance = 0.001
-                        discrepancies = abs(customer_sum - total_values) > tolerance
-                        
-                        if discrepancies.any():
-                            raise DataProcessingError(f"Customer type quantity validation failed for {target_product}. Contact administrator to review data integrity.")
-                
-                # Check weight validation
-                total_wt_col = f'total_{clean_product}_release_weight'
-                if total_wt_col in summary_df.columns:
-                    customer_wt_cols = [col for col in summary_df.columns 
-                                      if col.startswith(f'{clean_product}_release_') 
-                                      and col.endswith('_weight')]
+                    customer_sum = summary_df[customer_cols].to_numpy(dtype=float).sum(axis=1)
+                    total_values = summary_df[total_col].to_numpy(dtype=float)
                     
-                    if customer_wt_cols:
-                        customer_sum = summary_df[customer_wt_cols].sum(axis=1)
-                        total_values = summary_df[total_wt_col]
-                        
-                        # Allow for small floating point differences
-                        tolerance = 0.001
-                        discrepancies = abs(customer_sum - total_values) > tolerance
-                        
-                        if discrepancies.any():
-                            raise DataProcessingError(f"Customer type weight validation failed for {target_product}. Contact administrator to review data integrity.")
-
-        # Sort by year_month in ascending order to process chronologically
-        summary_df['sort_date'] = pd.to_datetime(summary_df['year_month'], format='%Y-%b')
-        summary_df = summary_df.sort_values('sort_date')
+                    # Allow for small floating point differences
+                    if not np.isclose(customer_sum, total_values, rtol=0, atol=0.001).all():
+                        raise DataProcessingError(f"Customer type {metric} validation failed for {target_product}. Contact administrator to review data integrity.")
 
         # Create dynamic opening stock and stock balance columns
         opening_stock_columns = []
@@ -381,53 +428,29 @@ def create_summary_df(stock_inflow_df: pd.DataFrame, release_df: pd.DataFrame) -
         for column in opening_stock_columns + stock_balance_columns:
             summary_df[column] = 0.0
 
-        # Calculate running balances for each month
-        for i in range(len(summary_df)):
-            for product_type in all_products:
-                summary_key = product_type.replace(' ', '_').lower()
-                
-                # Handle quantity columns
-                qty_opening_col = f'{summary_key}_quantity_opening_stock'
-                qty_balance_col = f'{summary_key}_quantity_stock_balance'
-                qty_inflow_col = f'total_{summary_key}_inflow_quantity'
-                qty_release_col = f'total_{summary_key}_release_quantity'
-                
-                if qty_opening_col in summary_df.columns and qty_balance_col in summary_df.columns:
-                    if i == 0:
-                        summary_df.iloc[i, summary_df.columns.get_loc(qty_opening_col)] = 0
-                    else:
-                        summary_df.iloc[i, summary_df.columns.get_loc(qty_opening_col)] = \
-                            summary_df.iloc[i-1, summary_df.columns.get_loc(qty_balance_col)]
-                    
-                    # Calculate balance
-                    opening_stock = summary_df.iloc[i, summary_df.columns.get_loc(qty_opening_col)]
-                    inflow = summary_df.iloc[i, summary_df.columns.get_loc(qty_inflow_col)] if qty_inflow_col in summary_df.columns else 0
-                    release = summary_df.iloc[i, summary_df.columns.get_loc(qty_release_col)] if qty_release_col in summary_df.columns else 0
-                    summary_df.iloc[i, summary_df.columns.get_loc(qty_balance_col)] = opening_stock + inflow - release
-                
-                # Handle weight columns
-                wt_opening_col = f'{summary_key}_weight_opening_stock'
-                wt_balance_col = f'{summary_key}_weight_stock_balance'
-                wt_inflow_col = f'total_{summary_key}_inflow_weight'
-                wt_release_col = f'total_{summary_key}_release_weight'
-                
-                if wt_opening_col in summary_df.columns and wt_balance_col in summary_df.columns:
-                    if i == 0:
-                        summary_df.iloc[i, summary_df.columns.get_loc(wt_opening_col)] = 0
-                    else:
-                        summary_df.iloc[i, summary_df.columns.get_loc(wt_opening_col)] = \
-                            summary_df.iloc[i-1, summary_df.columns.get_loc(wt_balance_col)]
-                    
-                    # Calculate balance
-                    opening_stock = summary_df.iloc[i, summary_df.columns.get_loc(wt_opening_col)]
-                    inflow = summary_df.iloc[i, summary_df.columns.get_loc(wt_inflow_col)] if wt_inflow_col in summary_df.columns else 0
-                    release = summary_df.iloc[i, summary_df.columns.get_loc(wt_release_col)] if wt_release_col in summary_df.columns else 0
-                    summary_df.iloc[i, summary_df.columns.get_loc(wt_balance_col)] = opening_stock + inflow - release
-
-        # Sort in descending order (newest first) and clean up
-        summary_df = summary_df.sort_values('sort_date', ascending=False)
-        summary_df['year_month'] = summary_df['sort_date'].dt.strftime('%Y-%m')
-        summary_df = summary_df.drop('sort_date', axis=1)
+        # Calculate running balances: each month's balance is the cumulative
+        # net movement, and its opening stock is the previous month's balance
+        for product_type in all_products:
+            summary_key = product_type.replace(' ', '_').lower()
+            for metric in ('quantity', 'weight'):
+                opening_col = f'{summary_key}_{metric}_opening_stock'
+                balance_col = f'{summary_key}_{metric}_stock_balance'
+                if opening_col not in summary_df.columns or balance_col not in summary_df.columns:
+                    continue
+
+                inflow_col = f'total_{summary_key}_inflow_{metric}'
+                release_col = f'total_{summary_key}_release_{metric}'
+                inflow = summary_df[inflow_col].to_numpy(dtype=float) if inflow_col in summary_df.columns else 0.0
+                release = summary_df[release_col].to_numpy(dtype=float) if release_col in summary_df.columns else 0.0
+
+                balance = np.cumsum(np.zeros(len(summary_df)) + inflow - release)
+                opening = np.concatenate(([0.0], balance[:-1]))
+                summary_df[opening_col] = opening
+                summary_df[balance_col] = balance
+
+        # Reverse to newest first and switch year_month to its numeric form
+        summary_df = summary_df.iloc[::-1].copy()
+        summary_df['year_month'] = month_starts.dt.strftime('%Y-%m').to_numpy()[::-1]
         
         # Format all numeric columns to 3 decimal places
         numeric_columns = summary_df.select_dtypes(include=['float64', 'int64']).columns
@@ -440,53 +463,87 @@ def create_summary_df(stock_inflow_df: pd.DataFrame, release_df: pd.DataFrame) -
 
 def prepare_df_for_upload(df: pd.DataFrame) -> pd.DataFrame:
     print("\nPreparing dataframe for upload...")
-    df_copy = df.copy()
+    df_copy = df.copy(deep=False)
     
     date_columns = df_copy.select_dtypes(include=['datetime64']).columns
     for col in date_columns:
         df_copy[col] = df_copy[col].dt.strftime('%Y-%m-%d')
     
-    for col in df_copy.columns:
-        df_copy[col] = df_copy[col].fillna('')
-        df_copy[col] = df_copy[col].astype(str)
-        df_copy[col] = df_copy[col].replace('nan', '')
-    
-    return df_copy
-
-def upload_df_to_gsheet(df: pd.DataFrame, 
-                       spreadsheet_id: str, 
-                       sheet_name: str, 
-                       service: Any) -> bool:
+    return df_copy.fillna('').astype(str).replace('nan', '')
+
+def column_letter(column_number: int) -> str:
+    """Convert a 1-based column number to its A1 letter (1 -> A, 27 -> AA)"""
+    letters = ''
+    while column_number > 0:
+        column_number, remainder = divmod(column_number - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+def upload_dfs_to_gsheet(uploads: List[Tuple[pd.DataFrame, str]],
+                         spreadsheet_id: str,
+                         service: Any) -> bool:
+    """Overwrite several sheets with one batchUpdate, then clear whatever lies outside the new data.
+
+    Writing before clearing means a failed upload leaves the previous contents in place
+    rather than blank sheets.
+    """
+    sheet_names = [sheet_name for _, sheet_name in uploads]
     try:
-        print(f"\nUploading data to sheet: {sheet_name}")
-        df_to_upload = prepare_df_for_upload(df)
+        print(f"\nUploading data to sheets: {', '.join(sheet_names)}")
         
-        values = [df_to_upload.columns.tolist()]
-        values.extend([[str(cell) if cell is not None and cell == cell else '' 
-                       for cell in row] for row in df_to_upload.values.tolist()])
+        def _get_grid_sizes():
+            return service.spreadsheets().get(
+                spreadsheetId=spreadsheet_id,
+                fields='sheets(properties(title,gridProperties))'
+            ).execute()
         
-        def _clear_sheet():
-            return service.spreadsheets().values().clear(
+        # Stale ranges must stay inside each sheet's current grid, or the clear is rejected
+        grid_sizes = {
+            sheet['properties']['title']: sheet['properties'].get('gridProperties', {})
+            for sheet in robust_sheets_operation(_get_grid_sizes).get('sheets', [])
+        }
+        
+        data = []
+        stale_ranges = []
+        for df, sheet_name in uploads:
+            df_to_upload = prepare_df_for_upload(df)
+            
+            # prepare_df_for_upload leaves only NaN-free strings, so rows can be sent as-is
+            values = [df_to_upload.columns.tolist(), *df_to_upload.to_numpy(dtype=object).tolist()]
+            data.append({'range': f'{sheet_name}!A1', 'values': values})
+            
+            # Rows below and columns to the right of the new data may hold the previous upload
+            row_count, column_count = len(values), len(values[0])
+            grid = grid_sizes.get(sheet_name, {})
+            grid_rows, grid_columns = grid.get('rowCount', 0), grid.get('columnCount', 0)
+            if grid_rows > row_count and grid_columns > 0:
+                stale_ranges.append(f'{sheet_name}!A{row_count + 1}:{column_letter(grid_columns)}{grid_rows}')
+            if grid_columns > column_count and grid_rows > 0:
+                stale_ranges.append(f'{sheet_name}!{column_letter(column_count + 1)}1:'
+                                    f'{column_letter(grid_columns)}{min(row_count, grid_rows)}')
+        
+        def _update_sheets():
+            return service.spreadsheets().values().batchUpdate(
                 spreadsheetId=spreadsheet_id,
-                range=f'{sheet_name}!A1:ZZ'
+                body={'valueInputOption': 'RAW', 'data': data}
             ).execute()
         
-        def _update_sheet():
-            return service.spreadsheets().values().update(
+        def _clear_stale_ranges():
+            return service.spreadsheets().values().batchClear(
                 spreadsheetId=spreadsheet_id,
-                range=f'{sheet_name}!A1',
-                valueInputOption='RAW',
-                body={'values': values}
+                body={'ranges': stale_ranges}
             ).execute()
         
-        robust_sheets_operation(_clear_sheet)
-        result = robust_sheets_operation(_update_sheet)
+        result = robust_sheets_operation(_update_sheets)
+        for response in result.get('responses', []):
+            print(f"Updated {response.get('updatedCells')} cells in {response.get('updatedRange')}")
         
-        print(f"Updated {result.get('updatedCells')} cells in {sheet_name}")
+        if stale_ranges:
+            robust_sheets_operation(_clear_stale_ranges)
         return True
         
     except Exception as e:
-        print(f"Failed to upload to {sheet_name}: {str(e)}")
+        print(f"Failed to upload to {', '.join(sheet_names)}: {str(e)}")
         return False
 
 def process_sheets_data(stock_inflow_df: pd.DataFrame, 
@@ -548,8 +605,7 @@ def process_sheets_data(stock_inflow_df: pd.DataFrame,
                 release_df['product'] = release_df['product'].str.lower()
 
             release_df.loc[
-                release_df['product'].str.contains('gizzard',
-                                                 case=False, na=False),
+                release_df['product'].str.contains('gizzard', regex=False, na=False),
                 'quantity'
             ] = 0
 
@@ -578,12 +634,15 @@ def main():
             
         # Create credentials and services once
         credentials = get_credentials(CREDENTIALS_FILE)
-        source_spreadsheet = connect_to_sheets(credentials, source_spreadsheet_id)
-        sheets_service = build('sheets', 'v4', credentials=credentials)
+        sheets_service = build('sheets', 'v4', credentials=credentials,
+                               static_discovery=True, cache_discovery=False)
         
-        # Read the worksheets from source
-        stock_inflow_df = read_worksheet_to_df(source_spreadsheet, SHEET_NAMES['STOCK_INFLOW'])
-        release_df = read_worksheet_to_df(source_spreadsheet, SHEET_NAMES['RELEASE'])
+        # Read both source worksheets in one round trip
+        source_dfs = read_worksheets_to_dfs(
+            sheets_service, source_spreadsheet_id,
+            [SHEET_NAMES['STOCK_INFLOW'], SHEET_NAMES['RELEASE']])
+        stock_inflow_df = source_dfs[SHEET_NAMES['STOCK_INFLOW']]
+        release_df = source_dfs[SHEET_NAMES['RELEASE']]
         
         # Process the data
         stock_inflow_main_df, release_df, summary_df = process_sheets_data(
@@ -596,12 +655,8 @@ def main():
             (summary_df, SHEET_NAMES['SUMMARY'])
         ]
         
-        # Upload all datasets
-        success = True
-        for df, sheet_name in upload_tasks:
-            if not upload_df_to_gsheet(df, output_spreadsheet_id, sheet_name, sheets_service):
-                success = False
-                print(f"Failed to upload {sheet_name}")
+        # Upload all datasets in one clear and one update request
+        success = upload_dfs_to_gsheet(upload_tasks, output_spreadsheet_id, sheets_service)
         
         if success:
             print("\nData processing and upload completed successfully!")